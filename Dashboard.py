@@ -1,10 +1,24 @@
+import os
+import threading
 import pandas as pd
 import numpy as np 
 import plotly.express as px
 import plotly.graph_objects as go
 import dash
 from dash import Dash, dcc, html, Input, Output, dash_table, State
+from dash.exceptions import PreventUpdate
 from datetime import date, datetime, timedelta
+from figure_cache import CallbackCache
+from dataset import StatementStore, StatementWatcher
+from shared_dataset import SharedDataset
+from sqlite_store import SqliteStatementStore
+from merchants import MerchantCategorizer
+from anomalies import AnomalyDetector, Z_LIMIT, QUANTILE, MONTH_Z_LIMIT, MIN_CHARGES, WARMUP_CHARGES, load_budgets
+from bucketing import GRANULARITIES, bucket, bucket_sum, bucket_last
+from balance_history import WINDOWS, rolling_metrics
+from recurring import recurring_series
+from downsample import line_figure, visible_range
+from instrumentation import install, instrument, stage, record_rows, metrics
 
 pd.options.mode.chained_assignment = None
 
@@ -12,115 +26,243 @@ pd.options.mode.chained_assignment = None
 # UTILITY FUNCTIONS BEGIN HERE
 
 # CREDIT
+@instrument
 def get_credit_data(initial_csv):
     # Input -> string format of csv location
-    df = pd.read_csv(initial_csv)
-    df = df.drop(columns = ['Memo'], axis = 1)
-    new_columns = ['transaction_date', 'post_date', 'description', 'category', 'type', 'amount']
-    df.columns = new_columns
-    
-    df['transaction_date'] = pd.to_datetime(df['transaction_date'])
-    df['Transaction Date'] = [i.date() for i in df['transaction_date'].to_list()]
-    df['post_date'] = pd.to_datetime(df['post_date'])
+    with stage('read'):
+        df = pd.read_csv(initial_csv, usecols = ['Transaction Date', 'Description', 'Category', 'Type', 'Amount'])
+    record_rows(len(df))
+    df = df.rename(columns = {'Transaction Date' : 'transaction_date',
+                              'Description' : 'description',
+                              'Category' : 'category',
+                              'Type' : 'type',
+                              'Amount' : 'amount'})
+    with stage('parse dates'):
+        df['transaction_date'] = pd.to_datetime(df['transaction_date'])
     
     # REMOVING RETURNS AND CONVERTING NEGATIVE AMOUNTS TO POSITIVE TO REPRESENT TRANSACTIONS
     df = df[df['amount'] <= 0]
-    df['amount'] = df['amount'] * (-1)
     
-    df['transaction_year'] = df['transaction_date'].dt.year
-    df['transaction_month'] = df['transaction_date'].dt.month
-    df['month_name'] = df['transaction_date'].dt.month_name()
-    df = df.sort_values('transaction_date').drop(columns = {'post_date'})
+    # COMPACT SCHEMA: INTEGER CENTS, SMALL INTEGER YEAR / MONTH AND CATEGORICAL TEXT;
+    # DISPLAY COLUMNS (DOLLARS, DATES, MONTH NAMES) ARE ONLY DERIVED WHEN RENDERING
+    df['amount_cents'] = (df['amount'] * -100).round().astype('int64')
+    df['transaction_year'] = df['transaction_date'].dt.year.astype('int16')
+    df['transaction_month'] = df['transaction_date'].dt.month.astype('int8')
+    for col in ['description', 'category', 'type']:
+        df[col] = df[col].astype('category')
+    df = df.drop(columns = ['amount']).sort_values('transaction_date', kind = 'mergesort').reset_index(drop = True)
     
-    table_df = df.rename(columns = {'description' : 'Description',
-                             'category' : 'Category',
-                             'type' : 'Type',
-                             'amount' : 'Amount ($)'})
-    relevant_cols = ['Transaction Date', 'Description', 'Category', 'Type', 'Amount ($)']
-    table_df = table_df.sort_values('transaction_date')[relevant_cols]
     # Output -> final cleaned df that we pass into our dash application
-    return df, table_df
-
+    return df
 
-# GETTING DATA 
-flex_df = get_credit_data('flex.csv')
-unlimited_df =  get_credit_data('unlimited.csv')
-transactions_df = pd.concat([flex_df[0], unlimited_df[0]], ignore_index = True)
-output_df = pd.concat([flex_df[1], unlimited_df[1]], ignore_index = True)
 
 months = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
-years = sorted(pd.unique(transactions_df['transaction_year']).tolist())
-categories = pd.unique(transactions_df['category'])
+
+# DataTable column id -> transactions_df column used to filter and sort it server-side
+table_columns = {'Transaction Date' : 'transaction_date',
+                 'Description' : 'description',
+                 'Category' : 'category',
+                 'Type' : 'type',
+                 'Amount ($)' : 'amount_cents'}
+# Displayed dollars -> stored cents, for numeric filter_query clauses
+table_scales = {'Amount ($)' : 100}
+
+
+def month_number(month):
+    # Input -> month name from the dropdowns (or None); Output -> 1-12 (or None)
+    return None if month is None else months.index(month) + 1
 
 
 # BANKING
+@instrument
 def get_bank_data(initial_csv):
-    bank_df = pd.read_csv(initial_csv, index_col=False).drop(columns = {'Check or Slip #'})
-    bank_df['Posting Date'] = pd.to_datetime(bank_df['Posting Date'])
+    with stage('read'):
+        bank_df = pd.read_csv(initial_csv, index_col=False).drop(columns = {'Check or Slip #'})
+    record_rows(len(bank_df))
+    with stage('parse dates'):
+        bank_df['Posting Date'] = pd.to_datetime(bank_df['Posting Date'])
     
+    # STATEMENTS ARE EXPORTED NEWEST FIRST; REVERSING BEFORE A STABLE SORT KEEPS SAME-DAY ROWS IN POSTING ORDER
+    ledger = bank_df.iloc[::-1].sort_values('Posting Date', kind = 'mergesort').reset_index(drop = True)
+    for col in ['Details', 'Description', 'Type']:
+        ledger[col] = ledger[col].astype('category')
+    
+    with stage('aggregate'):
+        acct_balance, monthly_net = bank_summary(ledger, 'month')
+    
+    # Output -> month-end balances, monthly net income, and the chronological ledger for other granularities
+    return acct_balance, monthly_net, ledger
+
+
+def bank_summary(ledger, granularity = 'month'):
     # GETTING NET INCOME DATA
-    bank_df['Month/Year'] = [datetime(bank_df['Posting Date'].to_list()[i].year, bank_df['Posting Date'].to_list()[i].month, 28) for i in range(len(bank_df['Posting Date']))]
-    monthly_net = bank_df.groupby(['Month/Year']).sum('Amount').reset_index()[['Month/Year', 'Amount']]
+    net = bucket_sum(ledger, 'Posting Date', 'Amount', granularity).rename(columns = {'Posting Date' : 'Month/Year'})
     
-    # GETTING MONTHLY ACCOUNT BALANCE DATA
-    df = bank_df[['Posting Date', 'Balance']]
-    df['Month/Year'] = [datetime(df['Posting Date'].to_list()[i].year, df['Posting Date'].to_list()[i].month, 1) for i in range(len(df['Posting Date']))]
-    df['Rank'] = df.groupby('Month/Year')['Posting Date'].rank(method = 'first').astype(int)
-    join_df = df[['Month/Year', 'Rank']].groupby('Month/Year').max('Rank').reset_index()
-    acct_balance = pd.merge(join_df, df, left_on = ['Month/Year', 'Rank'], right_on = ['Month/Year', 'Rank'])
+    # GETTING ACCOUNT BALANCE DATA (LAST POSTED BALANCE OF EACH BUCKET)
+    if 'account' in ledger and ledger['account'].nunique() > 1:
+        # WITH SEVERAL BANK ACCOUNTS, EACH ONE'S LAST BALANCE IS CARRIED INTO BUCKETS WHERE IT HAD NO ROWS AND
+        # THE ACCOUNTS ARE SUMMED, SO THE TOTAL NEVER JUMPS BETWEEN ONE ACCOUNT'S BALANCE AND ANOTHER'S
+        last = [bucket_last(rows[['Posting Date', 'Balance']], 'Posting Date', granularity, label_col = 'Month/Year').set_index('Month/Year')
+                for _, rows in ledger.groupby('account', observed = True, sort = False)]
+        wide = pd.concat(last, axis = 1, keys = range(len(last))).sort_index()
+        acct_balance = pd.DataFrame({'Posting Date' : wide.xs('Posting Date', axis = 1, level = 1).max(axis = 1),
+                                     'Balance' : wide.xs('Balance', axis = 1, level = 1).ffill().sum(axis = 1).round(2)}).reset_index()
+    else:
+        acct_balance = bucket_last(ledger[['Posting Date', 'Balance']], 'Posting Date', granularity, label_col = 'Month/Year')
     
-    return acct_balance, monthly_net
+    return acct_balance, net
+
+
+# GETTING DATA 
+# Every credit / bank csv in the statements directory is parsed (through the columnar cache) into an
+# immutable Dataset snapshot; the watcher re-parses only new or changed files and swaps in a new one.
+# Workers started by serve.py instead map the snapshot it published to DASHBOARD_SHARED_DIR, and the
+# watcher only checks whether a newer version has been published. DASHBOARD_SQLITE_PATH keeps card
+# transactions in an SQLite file instead, and the transaction callbacks push their queries down to it.
+# DASHBOARD_LAZY_START=1 binds the server first and loads the statements in a background thread, then
+# warms the figures a fresh page asks for; the page shows its data as soon as the first snapshot exists.
+# Bank rows (and card rows the issuer left uncategorised) are categorised by the merchant rules in
+# merchant_rules.csv; rules in DASHBOARD_MERCHANT_RULES take precedence over the bundled ones.
+statements_dir = os.environ.get('DASHBOARD_STATEMENTS_DIR', '.')
+reload_seconds = float(os.environ.get('DASHBOARD_RELOAD_SECONDS', 30))
+lazy_start = os.environ.get('DASHBOARD_LAZY_START', '0') == '1'
+shared_dir = os.environ.get('DASHBOARD_SHARED_DIR')
+sqlite_path = os.environ.get('DASHBOARD_SQLITE_PATH')
+rule_files = [os.environ.get('DASHBOARD_MERCHANT_RULES'), os.path.join(os.path.dirname(os.path.abspath(__file__)), 'merchant_rules.csv')]
+categorizer = MerchantCategorizer.from_csv(*[path for path in rule_files if path])
+# Monthly budgets per category (category,monthly_budget in dollars) for the spending alerts panel
+budgets = load_budgets(os.environ.get('DASHBOARD_BUDGETS', os.path.join(statements_dir, 'budgets.csv')))
+# Spending alert thresholds: standard deviations and quantile a charge must clear, standard deviations for a
+# month, the charges a category needs before the standard deviation test applies, and before any test does
+detector = AnomalyDetector(z_limit = float(os.environ.get('DASHBOARD_ALERT_Z', Z_LIMIT)),
+                           quantile = float(os.environ.get('DASHBOARD_ALERT_QUANTILE', QUANTILE)),
+                           month_z_limit = float(os.environ.get('DASHBOARD_ALERT_MONTH_Z', MONTH_Z_LIMIT)),
+                           min_charges = int(os.environ.get('DASHBOARD_ALERT_MIN_CHARGES', MIN_CHARGES)),
+                           warmup_charges = int(os.environ.get('DASHBOARD_ALERT_WARMUP_CHARGES', WARMUP_CHARGES)))
+if shared_dir:
+    store = SharedDataset(shared_dir)
+elif sqlite_path:
+    store = SqliteStatementStore(statements_dir, sqlite_path, get_credit_data, get_bank_data, bank_summary,
+                                 load = not lazy_start, categorizer = categorizer, detector = detector)
+else:
+    store = StatementStore(statements_dir, get_credit_data, get_bank_data, bank_summary,
+                           load = not lazy_start, categorizer = categorizer, detector = detector)
+
+# Memoized callback results, keyed by their inputs and the version of the statements they were built from
+figure_cache = CallbackCache(max_entries = int(os.environ.get('DASHBOARD_FIGURE_CACHE_ENTRIES', 256)),
+                             max_bytes = int(os.environ.get('DASHBOARD_FIGURE_CACHE_BYTES', 0)) or None,
+                             disk_dir = os.environ.get('DASHBOARD_FIGURE_CACHE_DIR'))
+store.listeners.append(lambda snapshot: figure_cache.set_version(snapshot.version))
+if store.snapshot is not None:
+    figure_cache.set_version(store.snapshot.version)
+metrics.gauges['dashboard_figure_cache_hits'] = lambda: figure_cache.stats()['hits']
+metrics.gauges['dashboard_figure_cache_misses'] = lambda: figure_cache.stats()['misses']
+metrics.gauges['dashboard_transactions'] = lambda: len(store.snapshot.transactions) if store.snapshot is not None else 0
 
-balance, income = get_bank_data('bank_account.csv')[0], get_bank_data('bank_account.csv')[1]
 
-def account_balance(df):
-    line_fig = px.line(x = df['Posting Date'], y = df['Balance'], markers = True)
+def current_dataset():
+    # UNTIL A LAZY START HAS LOADED THE FIRST SNAPSHOT, CALLBACKS LEAVE THEIR OUTPUTS ALONE; dataset-poll
+    # DELIVERS THE VERSION ONCE IT EXISTS, WHICH FIRES THEM AGAIN
+    if store.snapshot is None:
+        raise PreventUpdate
+    return store.snapshot
+
+
+def account_balance(df, granularity = 'month', relayout_data = None):
+    line_fig = line_figure(df['Posting Date'], df['Balance'], relayout_data)
     line_fig.update_layout(
         xaxis_title = "Date",
         yaxis_title = "Account Balance ($)",
-        title = 'Latest Account Balance per Month',
+        title = 'Latest Account Balance per ' + granularity.capitalize(),
         title_x = 0.5)
     
     bar_fig = px.bar(x = df['Posting Date'], y = df['Balance'])
     bar_fig.update_layout(
         xaxis_title = "Date",
         yaxis_title = "Account Balance ($)",
-        title = 'Latest Account Balance per Month',
+        title = 'Latest Account Balance per ' + granularity.capitalize(),
         title_x = 0.5)
     
     return line_fig, bar_fig
 
-def net_income(df):
-    line_fig = px.line(x = df['Month/Year'], y = df['Amount'], markers = True)
+def rolling_balance(daily, window_stats, window):
+    # DAILY BALANCE WITH ITS TRAILING AVERAGE, INSIDE THE BAND OF THE WINDOW'S LOWEST AND HIGHEST BALANCE
+    fig = go.Figure([
+        go.Scatter(x = window_stats.index, y = window_stats['max_balance'], name = '{}-day max'.format(window), line = dict(width = 0), showlegend = False),
+        go.Scatter(x = window_stats.index, y = window_stats['min_balance'], name = '{}-day min'.format(window), line = dict(width = 0),
+                   fill = 'tonexty', fillcolor = 'rgba(99, 110, 250, 0.15)', showlegend = False),
+        go.Scatter(x = daily.index, y = daily['balance'], name = 'Daily balance', line = dict(color = 'rgb(99, 110, 250)')),
+        go.Scatter(x = window_stats.index, y = window_stats['average_balance'], name = '{}-day average'.format(window), line = dict(color = 'rgb(239, 85, 59)'))
+    ])
+    fig.update_layout(
+        xaxis_title = "Date",
+        yaxis_title = "Account Balance ($)",
+        title = 'Daily Balance with {}-Day Average and Range'.format(window),
+        title_x = 0.5,
+        hovermode = 'x unified')
+    return fig
+
+def rolling_flow(window_stats, window):
+    fig = px.area(x = window_stats.index, y = window_stats['net_flow'])
+    fig.update_layout(
+        xaxis_title = "Date",
+        yaxis_title = "Net Flow ($)",
+        title = 'Net Flow over the Trailing {} Days'.format(window),
+        title_x = 0.5)
+    return fig
+
+def net_income(df, granularity = 'month'):
+    line_fig = line_figure(df['Month/Year'], df['Amount'])
     line_fig.update_layout(
         xaxis_title = "Date",
         yaxis_title = "Net Income($)",
-        title = 'Net Account Income (+/-) by Month',
+        title = 'Net Account Income (+/-) by ' + granularity.capitalize(),
         title_x = 0.5)
     
     bar_fig = px.bar(x = df['Month/Year'], y = df['Amount'])
     bar_fig.update_layout(
         xaxis_title = "Date",
-        yaxis_title = "Account Balance ($)",
-        title = 'Latest Account Balance per Month',
+        yaxis_title = "Net Income($)",
+        title = 'Net Account Income (+/-) by ' + granularity.capitalize(),
         title_x = 0.5)
     
     return line_fig, bar_fig
 
-balance_fig_line = account_balance(balance)[0]
-balance_fig_bar = account_balance(balance)[1]
-income_fig_line = net_income(income)[0]
-income_fig_bar = net_income(income)[1]
-
-
 app = dash.Dash()
 server = app.server
+# Server-Timing headers on every callback response, /metrics for scraping, and /debug/profile when
+# DASHBOARD_PROFILE_INTERVAL (seconds between stack samples) is set
+install(server, float(os.environ.get('DASHBOARD_PROFILE_INTERVAL', 0)) or None)
 app.title = 'Personal Finance Dashboard'
 
+
+# /healthz ANSWERS AS SOON AS THE PORT IS OPEN; /readyz ONLY ONCE THE STATEMENTS HAVE BEEN LOADED
+@server.route('/healthz')
+def healthz():
+    return 'ok'
+
+
+@server.route('/readyz')
+def readyz():
+    if not store.ready.is_set():
+        return 'loading statements', 503
+    return store.snapshot.version
+
+
+# A LAZY START SERVES THE PAGE BEFORE ANY STATEMENT IS PARSED; dataset-poll FILLS THE DROPDOWNS IN ONCE IT IS
+initial = store.snapshot
+poll_interval = max(reload_seconds, 1) * 1000
+
 app.layout = html.Div(
     id = 'root',
     children = [
         
+        # The client polls for a new dataset snapshot; a changed version refreshes dropdowns and figures
+        dcc.Store(id = 'dataset-version', data = initial.version if initial is not None else None),
+        dcc.Interval(id = 'dataset-poll',
+                     interval = poll_interval if initial is not None else 1000,
+                     disabled = initial is not None and reload_seconds <= 0),
+        
         html.Div(
             id = 'Header',
             children = [
@@ -152,7 +294,7 @@ app.layout = html.Div(
                                 ),
                                 dcc.Dropdown(
                                     id = 'pie-year',
-                                    options = years,
+                                    options = initial.years if initial is not None else [],
                                     value = None,
                                     search_value = '',
                                     style = {'marginBottom' : 5, 'font-family' : 'monospace', 'fontSize' : 16}
@@ -178,6 +320,13 @@ app.layout = html.Div(
                     ], style=dict(display='flex'), className = 'nine columns'
                 ),
                 
+                dcc.Checklist(
+                    id = 'pie-sources',
+                    options = [{'label' : ' Include bank account spending', 'value' : 'bank'}],
+                    value = [],
+                    style = {'font-family' : 'monospace', 'fontSize' : 16, 'margin-left' : '50px', 'marginTop' : 10}
+                ),
+                
                 dcc.Graph(id = 'pie-chart')
                 
             ]
@@ -219,7 +368,7 @@ app.layout = html.Div(
                                 ),
                                 dcc.Dropdown(
                                     id = 'transaction-year',
-                                    options = years,
+                                    options = initial.years if initial is not None else [],
                                     value = None,
                                     search_value = '',
                                     style = {'marginBottom' : 5, 'font-family' : 'monospace', 'fontSize' : 16}
@@ -251,7 +400,7 @@ app.layout = html.Div(
                                 ),
                                 dcc.Dropdown(
                                     id = 'category',
-                                    options = categories,
+                                    options = initial.categories if initial is not None else [],
                                     value = None,
                                     search_value = '',
                                     style = {'marginBottom' : 5, 'font-family' : 'monospace', 'fontSize' : 16}
@@ -261,23 +410,39 @@ app.layout = html.Div(
                     ], style = {'display' : 'flex', 'marginBottom' : 0}
                 ),
                 
+                html.Div(
+                    children = [
+                        dcc.Input(
+                            id = 'transaction-search',
+                            type = 'search',
+                            value = '',
+                            debounce = False,
+                            placeholder = 'Search merchants, e.g. "amazon" or "chick"',
+                            style = {'width' : '100%', 'font-family' : 'monospace', 'fontSize' : 16, 'padding' : '6px'}
+                        )
+                    ], style = {'marginTop' : 10, 'padding-left' : '70px', 'width' : '92%'}
+                ),
+                
                 dash_table.DataTable(
                     id = 'datatable',
-                    data = output_df.to_dict('records'), 
-                    columns = [{"name": i, "id": i} for i in output_df.columns],
+                    data = [],
+                    columns = [{"name": i, "id": i} for i in table_columns],
                     page_size = 10,
                     page_current= 0,
-                    sort_action="native",
+                    sort_action="custom",
                     sort_mode="multi",
+                    sort_by = [],
+                    filter_action = 'custom',
+                    filter_query = '',
                     column_selectable = 'single',
                     selected_columns = [],
-                    page_action = 'native',
+                    page_action = 'custom',
                     fixed_rows = {'headers' : True},
                     style_cell = {
                         'textAlign': 'center', 
                         'overflow' : 'hidden', 
                         'fontSize' : 15,
-                        'width' : '{}%'.format(len(output_df.columns))
+                        'width' : '{}%'.format(len(table_columns))
                     },
                     style_header = {'fontWeight': 'bold', 'color' : 'black', 'fontSize' : 16},
                     style_table = {
@@ -286,7 +451,28 @@ app.layout = html.Div(
                         'width': '92%'
                     }
                 ),
+                
+                html.P(
+                    id = 'datatable-count',
+                    style = {'fontSize' : 14, 'font-family' : 'monospace', 'textAlign' : 'right', 'color' : 'black', 'marginRight' : '70px'}
+                ),
                  
+                html.Div(
+                    children = [
+                        html.P(
+                            children = 'Group spending by:',
+                            style = {'fontSize' : 16, 'font-family' : 'monospace', 'color' : 'black', 'marginRight' : 10}
+                        ),
+                        dcc.RadioItems(
+                            id = 'month-sums-granularity',
+                            options = list(GRANULARITIES),
+                            value = 'month',
+                            inline = True,
+                            style = {'font-family' : 'monospace', 'fontSize' : 16}
+                        )
+                    ], style = {'display' : 'flex', 'alignItems' : 'center', 'justifyContent' : 'flex-end', 'marginRight' : '70px'}
+                ),
+                
                 html.Div(
                     children = [
                         dcc.Graph(id = 'line-chart', style={'margin-left': '30px', 'margin-right' : '0px', 'width' : '50%'}),
@@ -300,6 +486,78 @@ app.layout = html.Div(
         ),
         
         
+        html.Div(
+            id = 'alerts',
+            children = [
+                html.H4('Spending Alerts', 
+                        style = {'fontSize' : 32, 'font-family' : 'monospace', 'font-weight' : 'bold', 'textAlign' : 'center', 'marginTop' : 45, 'marginBottom' : 5}),
+                
+                html.Div(
+                    children = [
+                        html.Div(
+                            children = [
+                                html.P(
+                                    children = 'Unusually large charges',
+                                    style = {'fontSize' : 16, 'font-family' : 'monospace', 'textAlign' : 'center', 'color' : 'black', 'marginBottom' : 5}
+                                ),
+                                dash_table.DataTable(
+                                    id = 'charge-alerts',
+                                    data = [],
+                                    columns = [{'name' : i, 'id' : i} for i in ['Date', 'Description', 'Category', 'Amount ($)', 'Typical ($)', 'SDs above']],
+                                    page_size = 10,
+                                    style_cell = {'textAlign' : 'center', 'fontSize' : 14},
+                                    style_header = {'fontWeight' : 'bold', 'color' : 'black'}
+                                )
+                            ], style = {'width' : '50%', 'margin-left' : '50px', 'margin-right' : '15px'}
+                        ),
+                        
+                        html.Div(
+                            children = [
+                                html.P(
+                                    children = 'Months over budget or far above normal',
+                                    style = {'fontSize' : 16, 'font-family' : 'monospace', 'textAlign' : 'center', 'color' : 'black', 'marginBottom' : 5}
+                                ),
+                                dash_table.DataTable(
+                                    id = 'month-alerts',
+                                    data = [],
+                                    columns = [{'name' : i, 'id' : i} for i in ['Month', 'Category', 'Spent ($)', 'Budget ($)', 'Why']],
+                                    page_size = 10,
+                                    style_cell = {'textAlign' : 'center', 'fontSize' : 14},
+                                    style_header = {'fontWeight' : 'bold', 'color' : 'black'}
+                                )
+                            ], style = {'width' : '50%', 'margin-left' : '15px', 'margin-right' : '50px'}
+                        )
+                    ], style = {'display' : 'flex'}
+                )
+            ]
+        ),
+        
+        
+        html.Div(
+            id = 'recurring',
+            children = [
+                html.H4('Recurring Charges & Deposits', 
+                        style = {'fontSize' : 32, 'font-family' : 'monospace', 'font-weight' : 'bold', 'textAlign' : 'center', 'marginTop' : 45, 'marginBottom' : 5}),
+                
+                html.P(
+                    children = 'Subscriptions, bills and paychecks that repeat on a schedule, with when the next one is due',
+                    style = {'fontSize' : 16, 'font-family' : 'monospace', 'textAlign' : 'center', 'color' : 'black', 'marginBottom' : 5}
+                ),
+                dash_table.DataTable(
+                    id = 'recurring-table',
+                    data = [],
+                    columns = [{'name' : i, 'id' : i} for i in ['Merchant', 'Source', 'Direction', 'Cadence', 'Every (days)', 'Typical ($)',
+                                                                'Occurrences', 'Last', 'Next expected', 'Next amount ($)', 'Active']],
+                    page_size = 10,
+                    sort_action = 'native',
+                    style_cell = {'textAlign' : 'center', 'fontSize' : 14},
+                    style_header = {'fontWeight' : 'bold', 'color' : 'black'},
+                    style_table = {'width' : '90%', 'margin' : 'auto'}
+                )
+            ]
+        ),
+        
+        
         html.Div(
             id = 'bankinfo',
             children = [
@@ -308,18 +566,59 @@ app.layout = html.Div(
                 
                 html.Div(
                     children = [
-                        dcc.Graph(id = 'balance_line', figure = balance_fig_line, style={'margin-left': '30px', 'margin-right' : '0px', 'width' : '50%'}),
+                        html.P(
+                            children = 'Group bank activity by:',
+                            style = {'fontSize' : 16, 'font-family' : 'monospace', 'color' : 'black', 'marginRight' : 10}
+                        ),
+                        dcc.RadioItems(
+                            id = 'bank-granularity',
+                            options = list(GRANULARITIES),
+                            value = 'month',
+                            inline = True,
+                            style = {'font-family' : 'monospace', 'fontSize' : 16}
+                        )
+                    ], style = {'display' : 'flex', 'alignItems' : 'center', 'justifyContent' : 'center'}
+                ),
+                
+                html.Div(
+                    children = [
+                        dcc.Graph(id = 'balance_line', style={'margin-left': '30px', 'margin-right' : '0px', 'width' : '50%'}),
+                
+                        dcc.Graph(id = 'income_line', style={'margin-left': '0px', 'margin-right' : '30px', 'width' : '50%'})
+    
+                    ], style = {'display' : 'flex'}
+                ),
+                
+                html.Div(
+                    children = [
+                        dcc.Graph(id = 'balance_bar', style={'margin-left': '30px', 'margin-right' : '0px', 'width' : '50%'}),
                 
-                        dcc.Graph(id = 'income_line', figure = balance_fig_bar, style={'margin-left': '0px', 'margin-right' : '30px', 'width' : '50%'})
+                        dcc.Graph(id = 'income_bar', style={'margin-left': '0px', 'margin-right' : '30px', 'width' : '50%'})
     
                     ], style = {'display' : 'flex'}
                 ),
                 
                 html.Div(
                     children = [
-                        dcc.Graph(id = 'balance_bar', figure = income_fig_line, style={'margin-left': '30px', 'margin-right' : '0px', 'width' : '50%'}),
+                        html.P(
+                            children = 'Rolling window:',
+                            style = {'fontSize' : 16, 'font-family' : 'monospace', 'color' : 'black', 'marginRight' : 10}
+                        ),
+                        dcc.RadioItems(
+                            id = 'bank-window',
+                            options = [{'label' : '{} days'.format(w), 'value' : w} for w in WINDOWS],
+                            value = 30,
+                            inline = True,
+                            style = {'font-family' : 'monospace', 'fontSize' : 16}
+                        )
+                    ], style = {'display' : 'flex', 'alignItems' : 'center', 'justifyContent' : 'center', 'marginTop' : 20}
+                ),
+                
+                html.Div(
+                    children = [
+                        dcc.Graph(id = 'rolling_balance', style={'margin-left': '30px', 'margin-right' : '0px', 'width' : '50%'}),
                 
-                        dcc.Graph(id = 'income_bar', figure = income_fig_bar, style={'margin-left': '0px', 'margin-right' : '30px', 'width' : '50%'})
+                        dcc.Graph(id = 'rolling_flow', style={'margin-left': '0px', 'margin-right' : '30px', 'width' : '50%'})
     
                     ], style = {'display' : 'flex'}
                 )
@@ -331,71 +630,114 @@ app.layout = html.Div(
 
 
 # CALLBACKS BEGIN HERE
+@app.callback(
+    [Output('dataset-version', 'data'),
+     Output('dataset-poll', 'interval'),
+     Output('dataset-poll', 'disabled')],
+    [Input('dataset-poll', 'n_intervals')],
+    [State('dataset-version', 'data')]
+)
+@instrument
+def dataset_poll(n_intervals, version):
+    snapshot = store.snapshot
+    if snapshot is None or snapshot.version == version:
+        return dash.no_update, dash.no_update, dash.no_update
+    # THE FIRST VERSION A LAZILY STARTED PAGE SEES ALSO SLOWS ITS POLLING DOWN TO THE RELOAD CADENCE
+    return snapshot.version, poll_interval, reload_seconds <= 0
+
+
+@app.callback(
+    [Output('pie-year', 'options'),
+     Output('transaction-year', 'options'),
+     Output('category', 'options')],
+    [Input('dataset-version', 'data')]
+)
+@instrument
+def dropdown_update(version):
+    data = current_dataset()
+    return data.years, data.years, data.categories
+
+
 @app.callback(
     Output('pie-chart', 'figure'),
     [Input('pie-year', 'value'),
-     Input('pie-month', 'value')
+     Input('pie-month', 'value'),
+     Input('pie-sources', 'value'),
+     Input('dataset-version', 'data')
     ]
 )
-def piechart_update(year, month):
-    df = transactions_df
-    year_str = ''
-    month_str = ''
-    if (month is None) and (year is None):
-        pass
-    if (month is None) and (year is not None):
-        df = df[df['transaction_year'] == year]
-        year_str = ' ' + str(year)
-    if (year is None) and (month is not None):
-        df = df[df['month_name'] == month]
-        month_str = ' ' + str(month)
-    if month and year:
-        df = df[(df['transaction_year'] == year) & (df['month_name'] == month)]
-        year_str = ' ' + str(year)
-        month_str = ' ' + str(month)
-    fig = px.pie(df, values = df['amount'], names = df['category'], hole = 0.15)
-    fig.update_layout(title = 'Spending by Category during:' + month_str + year_str)
+@instrument
+@figure_cache.memoize
+def piechart_update(year, month, sources = None, version = None):
+    year_str = '' if year is None else ' ' + str(year)
+    month_str = '' if month is None else ' ' + str(month)
+    with stage('aggregate'):
+        data = current_dataset()
+        totals = data.spending.by_category(year, month_number(month))
+        if 'bank' in (sources or []):
+            # TRANSFERS, CARD PAYMENTS AND INVESTMENTS ARE ALREADY LEFT OUT, SO CARD SPENDING IS NOT COUNTED TWICE
+            totals = totals.add(data.bank_spending.by_category(year, month_number(month)), fill_value = 0)
+    with stage('figure'):
+        fig = px.pie(values = totals.values, names = totals.index, hole = 0.15)
+        fig.update_layout(title = 'Spending by Category during:' + month_str + year_str)
     return fig
 
 
 @app.callback(
-    Output('datatable', 'data'),
+    Output('datatable', 'page_current'),
+    [Input('date_range_line', 'start_date'),
+     Input('date_range_line', 'end_date'),
+     Input('category', 'value'),
+     Input('transaction-year', 'value'),
+     Input('transaction-month', 'value'),
+     Input('datatable', 'sort_by'),
+     Input('datatable', 'filter_query'),
+     Input('transaction-search', 'value')
+    ]
+)
+@instrument
+def datatable_reset_page(start, end, category, year, month, sort_by, filter_query, search):
+    # ANY CHANGE TO THE FILTERS OR SORT ORDER STARTS THE TABLE BACK ON ITS FIRST PAGE
+    return 0
+
+
+@app.callback(
+    [Output('datatable', 'data'),
+     Output('datatable', 'page_count'),
+     Output('datatable-count', 'children')],
     [Input('date_range_line', 'start_date'),
      Input('date_range_line', 'end_date'),
      Input('category', 'value'),
      Input('transaction-year', 'value'),
-     Input('transaction-month', 'value')
+     Input('transaction-month', 'value'),
+     Input('datatable', 'page_current'),
+     Input('datatable', 'page_size'),
+     Input('datatable', 'sort_by'),
+     Input('datatable', 'filter_query'),
+     Input('transaction-search', 'value'),
+     Input('dataset-version', 'data')
     ]
 )
-def datatable_update(start, end, category, year, month):
-    df = transactions_df.sort_values('transaction_date')
-    if category is not None:
-        df = df[df['category'] == category]
-    if start is not None:
-        start_date = pd.to_datetime(start)
-        df = df[(df['transaction_date'] >= start_date)]
-    if end is not None:
-        end_date = pd.to_datetime(end)
-        df = df[(df['transaction_date'] <= end_date)]
-    if start is not None and end is not None:
-        start_date = pd.to_datetime(start)
-        end_date = pd.to_datetime(end)
-        df = df[(df['transaction_date'] >= start_date) & (df['transaction_date'] <= end_date)]
-    if (year is not None) and (month is None):
-        df = df[df['transaction_year'] == year]
-    if (year is None) and (month is not None):
-        df = df[df['month_name'] == month]
-    if month and year:
-        df = df[(df['transaction_year'] == year) & (df['month_name'] == month)]
+@instrument
+@figure_cache.memoize
+def datatable_update(start, end, category, year, month, page_current = 0, page_size = 10, sort_by = None, filter_query = None,
+                     search = None, version = None):
+    with stage('query'):
+        page, page_count, total = current_dataset().transactions.page(start, end, category, year, month_number(month),
+                                                                      filter_query, sort_by, page_current, page_size,
+                                                                      table_columns, table_scales, search)
+    record_rows(total)
     
-    table_df = df.rename(columns = {'description' : 'Description',
-                             'category' : 'Category',
-                             'type' : 'Type',
-                             'amount' : 'Amount ($)'})
-    relevant_cols = ['Transaction Date', 'Description', 'Category', 'Type', 'Amount ($)']
-    table_df = table_df.sort_values('transaction_date')[relevant_cols]
+    # ONLY THE REQUESTED PAGE IS CONVERTED TO DISPLAY VALUES AND SERIALISED
+    with stage('format'):
+        table_df = pd.DataFrame({'Transaction Date' : page['transaction_date'].dt.date,
+                                 'Description' : page['description'].astype(object),
+                                 'Category' : page['category'].astype(object),
+                                 'Type' : page['type'].astype(object),
+                                 'Amount ($)' : page['amount_cents'] / 100})
+        records = table_df.to_dict('records')
     
-    return table_df.to_dict('records')
+    return records, page_count, '{:,} transactions'.format(total)
     
 
 @app.callback(
@@ -404,29 +746,18 @@ def datatable_update(start, end, category, year, month):
      Input('date_range_line', 'end_date'),
      Input('category', 'value'),
      Input('transaction-year', 'value'),
-     Input('transaction-month', 'value')
+     Input('transaction-month', 'value'),
+     Input('line-chart', 'relayoutData'),
+     Input('transaction-search', 'value'),
+     Input('dataset-version', 'data')
     ]
 )
-def linechart_update(start, end, category, year, month):
-    df = transactions_df.sort_values('transaction_date')
-    if category is not None:
-        df = df[df['category'] == category]
-    if start is not None:
-        start_date = pd.to_datetime(start)
-        df = df[(df['transaction_date'] >= start_date)]
-    if end is not None:
-        end_date = pd.to_datetime(end)
-        df = df[(df['transaction_date'] <= end_date)]
-    if start is not None and end is not None:
-        start_date = pd.to_datetime(start)
-        end_date = pd.to_datetime(end)
-        df = df[(df['transaction_date'] >= start_date) & (df['transaction_date'] <= end_date)]
-    if (year is not None) and (month is None):
-        df = df[df['transaction_year'] == year]
-    if (year is None) and (month is not None):
-        df = df[df['month_name'] == month]
-    if month and year:
-        df = df[(df['transaction_year'] == year) & (df['month_name'] == month)]
+@instrument
+@figure_cache.memoize
+def linechart_update(start, end, category, year, month, relayout_data = None, search = None, version = None):
+    with stage('filter'):
+        df = current_dataset().transactions.series(start, end, category, year, month_number(month), visible_range(relayout_data), search)
+    record_rows(len(df))
     if len(df) == 0:
         fig = px.line(title = 'Overall')
         fig.update_layout(
@@ -434,7 +765,9 @@ def linechart_update(start, end, category, year, month):
             yaxis_title = "Amount ($)",
             title_x = 0.5)
         return fig
-    fig = px.line(x = df['transaction_date'], y = df['amount'], markers = True)
+    # LONG HISTORIES SWITCH TO A DOWNSAMPLED WEBGL TRACE, RE-FETCHED AT FULL DETAIL AS THE USER ZOOMS IN
+    with stage('figure'):
+        fig = line_figure(df['transaction_date'], df['amount_cents'] / 100, relayout_data)
     fig.update_layout(
         xaxis_title = "Date",
         yaxis_title = "Amount ($)",
@@ -444,22 +777,8 @@ def linechart_update(start, end, category, year, month):
     
 
 def end_of_month(df):
-    thirty1 = [1, 3, 5, 7, 8, 10, 12]
-    thirty = [4, 6, 9, 11]
-    other = [2]
-    
-    dates = []
-    for i in range(len(df)):
-        year = df['transaction_date'].to_list()[i].year
-        month = df['transaction_date'].to_list()[i].month
-        if month in thirty1:
-            dates.append(datetime(year, month, 31))
-        elif month in thirty:
-            dates.append(datetime(year, month, 30))
-        else:
-            dates.append(datetime(year, month, 28))
-
-    return dates
+    # Output -> the last day of each row's month (vectorized; leap years included)
+    return bucket(df['transaction_date'], 'month', label = 'end')
 
 
 @app.callback(
@@ -467,43 +786,184 @@ def end_of_month(df):
     [Input('date_range_line', 'start_date'),
      Input('date_range_line', 'end_date'),
      Input('category', 'value'),
-     Input('transaction-year', 'value')
+     Input('transaction-year', 'value'),
+     Input('month-sums-granularity', 'value'),
+     Input('dataset-version', 'data')
     ]
 )
-def monthsum_update(start, end, category, year):
-    df = transactions_df.sort_values('transaction_date')
-    if category is not None:
-        df = df[df['category'] == category]
-    if start is not None:
-        start_date = pd.to_datetime(start)
-        df = df[(df['transaction_date'] >= start_date)]
-    if end is not None:
-        end_date = pd.to_datetime(end)
-        df = df[(df['transaction_date'] <= end_date)]
-    if start is not None and end is not None:
-        start_date = pd.to_datetime(start)
-        end_date = pd.to_datetime(end)
-        df = df[(df['transaction_date'] >= start_date) & (df['transaction_date'] <= end_date)]
-    if (year is not None):
-        df = df[df['transaction_year'] == year]
-    if len(df) == 0:
-        fig = px.line(title = 'Total Spending per Month')
+@instrument
+@figure_cache.memoize
+def monthsum_update(start, end, category, year, granularity = 'month', version = None):
+    data = current_dataset()
+    title = 'Total Spending per ' + granularity.capitalize()
+    if granularity in ('day', 'week'):
+        with stage('filter'):
+            daily = data.transactions.daily_totals(start, end, category, year)
+        record_rows(len(daily))
+        with stage('aggregate'):
+            output_df = bucket_sum(daily, 'transaction_date', 'amount_cents', granularity)
+            output_df['amount'] = output_df['amount_cents'] / 100
+    else:
+        # MONTHS, QUARTERS AND YEARS ARE ROLLED UP FROM THE SPENDING CUBE'S MONTHLY TOTALS
+        with stage('aggregate'):
+            totals = data.spending.by_month(year, category, start, end, data.transactions)
+            df = pd.DataFrame({'transaction_date' : pd.to_datetime({'year' : totals.index.get_level_values('year'),
+                                                                   'month' : totals.index.get_level_values('month'),
+                                                                   'day' : 1}),
+                               'amount' : totals.values})
+            output_df = bucket_sum(df, 'transaction_date', 'amount', granularity)
+    if len(output_df) == 0:
+        fig = px.line(title = title)
         fig.update_layout(
             xaxis_title = "Date",
             yaxis_title = "Amount ($)",
             title_x = 0.5)
         return fig
     
-    df['Month/Year'] = end_of_month(df)
-    output_df = df[['Month/Year', 'amount']].groupby('Month/Year').sum('amount').reset_index() 
-    fig = px.line(x = output_df['Month/Year'], y = output_df['amount'], markers = True)
-    fig.update_layout(
-        xaxis_title = "Date",
-        yaxis_title = "Amount ($)",
-        title = 'Total Spending per Month',
-        title_x = 0.5)
+    with stage('figure'):
+        fig = px.line(x = output_df['transaction_date'], y = output_df['amount'], markers = True)
+        fig.update_layout(
+            xaxis_title = "Date",
+            yaxis_title = "Amount ($)",
+            title = title,
+            title_x = 0.5)
     return fig
 
+
+@app.callback(
+    [Output('balance_line', 'figure'),
+     Output('income_line', 'figure'),
+     Output('balance_bar', 'figure'),
+     Output('income_bar', 'figure')],
+    [Input('bank-granularity', 'value'),
+     Input('balance_line', 'relayoutData'),
+     Input('dataset-version', 'data')]
+)
+@instrument
+@figure_cache.memoize
+def bank_update(granularity = 'month', relayout_data = None, version = None):
+    data = current_dataset()
+    with stage('aggregate'):
+        if granularity == 'month':
+            acct_balance, net = data.balance, data.income
+        else:
+            acct_balance, net = bank_summary(data.ledger, granularity)
+    with stage('figure'):
+        balance_line, balance_bar = account_balance(acct_balance, granularity, relayout_data)
+        income_line, income_bar = net_income(net, granularity)
+    return balance_line, balance_bar, income_line, income_bar
+
+
+@app.callback(
+    [Output('charge-alerts', 'data'),
+     Output('month-alerts', 'data')],
+    [Input('dataset-version', 'data')]
+)
+@instrument
+@figure_cache.memoize
+def alerts_update(version = None):
+    # THE DETECTOR WAS UPDATED AS STATEMENTS WERE INGESTED; THIS ONLY FORMATS WHAT IT FLAGGED
+    anomalies = current_dataset().anomalies
+    charges = [{'Date' : a['date'].date(),
+                'Description' : a['description'],
+                'Category' : a['category'],
+                'Amount ($)' : a['amount_cents'] / 100,
+                'Typical ($)' : round(a['mean_cents'] / 100, 2),
+                'SDs above' : round(a['z'], 1)} for a in anomalies.charge_alerts()]
+    months_over = [{'Month' : '{} {}'.format(months[a['month'] - 1], a['year']),
+                    'Category' : a['category'],
+                    'Spent ($)' : a['total_cents'] / 100,
+                    'Budget ($)' : a['budget_cents'] / 100 if a['budget_cents'] is not None else None,
+                    'Why' : a['reason']} for a in anomalies.month_alerts(budgets)]
+    return charges, months_over
+
+
+@app.callback(
+    Output('recurring-table', 'data'),
+    [Input('dataset-version', 'data')]
+)
+@instrument
+@figure_cache.memoize
+def recurring_update(version = None):
+    data = current_dataset()
+    merchant_of = lambda description : categorizer.resolve(description)[0]
+    record_rows(len(data.transactions) + len(data.ledger))
+    with stage('aggregate'):
+        # CARD ROWS ARRIVE A FEW MERCHANTS AT A TIME, SO THE SQLite BACKEND NEVER LOADS THE WHOLE TABLE
+        chunks = data.transactions.merchant_chunks(merchant_of, ['transaction_date', 'description', 'amount_cents'])
+        found = recurring_series(chunks, data.ledger, merchant_of)
+    return [{'Merchant' : r.merchant,
+             'Source' : r.source,
+             'Direction' : r.direction,
+             'Cadence' : r.cadence,
+             'Every (days)' : float(r.period_days),
+             'Typical ($)' : r.typical_cents / 100,
+             'Occurrences' : int(r.occurrences),
+             'Last' : r.last_date.date(),
+             'Next expected' : r.next_date.date(),
+             'Next amount ($)' : r.next_cents / 100,
+             'Active' : 'yes' if r.active else 'no'} for r in found.itertuples()]
+
+
+@app.callback(
+    [Output('rolling_balance', 'figure'),
+     Output('rolling_flow', 'figure')],
+    [Input('bank-window', 'value'),
+     Input('dataset-version', 'data')]
+)
+@instrument
+@figure_cache.memoize
+def rolling_update(window = 30, version = None):
+    daily = current_dataset().daily_balance
+    with stage('aggregate'):
+        window_stats = rolling_metrics(daily, window)
+    record_rows(len(daily))
+    with stage('figure'):
+        balance_fig = rolling_balance(daily, window_stats, window)
+        flow_fig = rolling_flow(window_stats, window)
+    return balance_fig, flow_fig
+
+
+
+def warm_figures(snapshot):
+    # BUILDS (THROUGH THE FIGURE CACHE) EXACTLY WHAT A FRESH PAGE LOAD REQUESTS, SO THE FIRST VISITOR AFTER A
+    # START OR RELOAD IS SERVED FROM CACHE; A PAGE ARRIVING MID-BUILD WAITS FOR IT RATHER THAN BUILDING AGAIN
+    version = snapshot.version
+    try:
+        piechart_update(None, None, [], version)
+        datatable_update(None, None, None, None, None, 0, 10, [], '', '', version)
+        linechart_update(None, None, None, None, None, None, '', version)
+        monthsum_update(None, None, None, None, 'month', version)
+        bank_update('month', None, version)
+        rolling_update(30, version)
+        alerts_update(version)
+        recurring_update(version)
+    except Exception as e:
+        print('figure warm-up failed: {}'.format(e))
+
+
+def load_statements():
+    try:
+        store.refresh()
+    except Exception as e:
+        # THE WATCHER (IF ENABLED) RETRIES ON ITS NEXT POLL
+        print('statement loading failed: {}'.format(e))
+
+
+def warm_in_background(snapshot):
+    threading.Thread(target = warm_figures, args = (snapshot,), name = 'figure-warmup', daemon = True).start()
+
+
+if lazy_start:
+    store.listeners.append(warm_in_background)
+    if store.snapshot is None:
+        threading.Thread(target = load_statements, name = 'statement-loader', daemon = True).start()
+    else:
+        warm_in_background(store.snapshot)
+
+if reload_seconds > 0:
+    StatementWatcher(store, reload_seconds).start()
+
     
 if __name__ == '__main__':
     app.run_server(debug = True, port = 4052)
\ No newline at end of file
@@ -0,0 +1,274 @@
+import copy
+import csv
+import hashlib
+import math
+
+import numpy as np
+import pandas as pd
+
+
+# Default thresholds. A charge is flagged when it is both Z_LIMIT standard deviations above its category's
+# mean charge and above the category's QUANTILE charge; a category month is flagged when it goes over its
+# budget, or MONTH_Z_LIMIT standard deviations above the category's typical month. Neither test fires
+# until the category has enough history for its statistics to mean something. A category with at least
+# WARMUP_CHARGES but fewer than MIN_CHARGES earlier charges has too few for a trustworthy mean, standard
+# deviation or 99th percentile, so a charge is flagged there when it is larger than every earlier one.
+Z_LIMIT = 3.0
+QUANTILE = 0.99
+MONTH_Z_LIMIT = 2.0
+MIN_CHARGES = 20
+WARMUP_CHARGES = 5
+MIN_MONTHS = 4
+UNCATEGORIZED = 'Uncategorized'
+
+
+class RunningStats:
+    # Welford's running count / mean / sum of squared deviations. Batches are folded in with Chan's
+    # pairwise update, and a value can be swapped for another, so totals that grow stay O(1) to track.
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self):
+        self.count, self.mean, self.m2 = 0, 0.0, 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def remove(self, value):
+        if self.count <= 1:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        delta = value - self.mean
+        self.count -= 1
+        self.mean -= delta / self.count
+        self.m2 = max(self.m2 - delta * (value - self.mean), 0.0)
+
+    def replace(self, old, new):
+        self.remove(old)
+        self.add(new)
+
+    def merge(self, count, mean, m2):
+        # Input -> count, mean and sum of squared deviations of a batch of new values
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+
+class QuantileSketch:
+    # Log-bucketed histogram: bucket i holds values in (gamma**(i-1), gamma**i], so any quantile is read
+    # back within relative_accuracy of the true value. Its size follows the range of amounts (a few
+    # hundred buckets from cents to millions), never the number of values added.
+    def __init__(self, relative_accuracy = 0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+
+    def copy(self):
+        other = copy.copy(self)
+        other.buckets = dict(self.buckets)
+        return other
+
+    def merge(self, other):
+        for key, n in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + n
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype = float)
+        positive = values[values > 0]
+        self.zeros += len(values) - len(positive)
+        self.count += len(values)
+        keys, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma).astype('int64'), return_counts = True)
+        for key, n in zip(keys.tolist(), counts.tolist()):
+            self.buckets[key] = self.buckets.get(key, 0) + n
+
+    def quantile(self, q):
+        # Output -> estimate of the q-quantile (0 <= q <= 1), or None before anything was added
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                # THE MIDPOINT OF THE BUCKET IN RELATIVE TERMS, WHICH IS WHAT BOUNDS THE RELATIVE ERROR
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return self.gamma ** max(self.buckets)
+
+    def maximum(self):
+        # Output -> the upper edge of the highest bucket, which no value added so far exceeds (None before any)
+        if self.count == 0:
+            return None
+        return self.gamma ** max(self.buckets) if self.buckets else 0.0
+
+
+def load_budgets(path):
+    # Input -> csv with category,monthly_budget (dollars); Output -> {category : budget in cents}
+    try:
+        with open(path, newline = '') as f:
+            return {r['category'] : int(round(float(r['monthly_budget']) * 100)) for r in csv.DictReader(f)}
+    except FileNotFoundError:
+        return {}
+
+
+class AnomalyDetector:
+    # Running per-category statistics of card charges and per-category monthly totals. add() takes only
+    # newly ingested rows: it scores just those rows and folds them into the statistics, never looking at
+    # earlier ones again, so the cost of an ingestion follows its own size, not the length of the history.
+    # A charge is scored against its category's statistics as of the start of its month: a month's charges
+    # join them only once a later month arrives. Whether a charge is flagged therefore depends on the data
+    # alone, not on how it was split into ingestions, provided each ingestion starts no earlier than the
+    # latest month already seen; accepts() checks that, and a batch that reaches back needs a fresh detector.
+    def __init__(self, z_limit = Z_LIMIT, quantile = QUANTILE, month_z_limit = MONTH_Z_LIMIT, min_charges = MIN_CHARGES,
+                 warmup_charges = WARMUP_CHARGES):
+        self.z_limit = z_limit
+        self.quantile = quantile
+        self.month_z_limit = month_z_limit
+        self.min_charges = min_charges
+        self.warmup_charges = warmup_charges
+        settings = repr((z_limit, quantile, month_z_limit, min_charges, warmup_charges, MIN_MONTHS))
+        # Output -> fingerprint of the thresholds, folded into the dataset version so cached alerts follow them
+        self.fingerprint = {'sha1' : hashlib.sha1(settings.encode()).hexdigest()}
+        self.charges = {}
+        self.sketches = {}
+        # CHARGES OF THE LATEST MONTH, HELD APART UNTIL A LATER MONTH CLOSES IT
+        self.month = None
+        self.open_charges = {}
+        self.open_sketches = {}
+        self.month_totals = {}
+        self.monthly = {}
+        self.alerts = []
+
+    def copy(self):
+        # A RELOAD UPDATES A COPY, SO THE SNAPSHOT STILL BEING SERVED KEEPS ITS OWN STATISTICS; ONLY THE
+        # MUTABLE STATE IS DUPLICATED, AND PAST ALERTS ARE SHARED
+        other = copy.copy(self)
+        other.charges = {k : copy.copy(v) for k, v in self.charges.items()}
+        other.sketches = {k : v.copy() for k, v in self.sketches.items()}
+        other.open_charges = {k : copy.copy(v) for k, v in self.open_charges.items()}
+        other.open_sketches = {k : v.copy() for k, v in self.open_sketches.items()}
+        other.month_totals = dict(self.month_totals)
+        other.monthly = {k : copy.copy(v) for k, v in self.monthly.items()}
+        other.alerts = list(self.alerts)
+        return other
+
+    def empty(self):
+        # Output -> a detector with the same thresholds and nothing added
+        return AnomalyDetector(self.z_limit, self.quantile, self.month_z_limit, self.min_charges, self.warmup_charges)
+
+    @staticmethod
+    def _months(df):
+        return df['transaction_year'].to_numpy(dtype = 'int64') * 12 + df['transaction_month'].to_numpy(dtype = 'int64') - 1
+
+    def accepts(self, df):
+        # Output -> True when df can be added without changing how earlier charges would have been scored
+        return len(df) == 0 or self.month is None or int(self._months(df).min()) >= self.month
+
+    def _close(self):
+        for category, stats in self.open_charges.items():
+            self.charges.setdefault(category, RunningStats()).merge(stats.count, stats.mean, stats.m2)
+            self.sketches.setdefault(category, QuantileSketch()).merge(self.open_sketches[category])
+        self.open_charges, self.open_sketches = {}, {}
+
+    def add(self, df):
+        # Input -> new transaction rows (transaction_date, description, category, amount_cents, year, month)
+        if len(df) == 0:
+            return
+        if not self.accepts(df):
+            raise ValueError('rows from before {} need a fresh detector'.format(self.month))
+        categories = df['category'].astype('category')
+        if categories.isna().any():
+            if UNCATEGORIZED not in categories.cat.categories:
+                categories = categories.cat.add_categories([UNCATEGORIZED])
+            categories = categories.fillna(UNCATEGORIZED)
+        amounts = df['amount_cents'].to_numpy(dtype = float)
+        rows = (df['transaction_date'].to_numpy(), df['description'].to_numpy())
+
+        # ROW POSITIONS GROUPED BY MONTH, THEN CATEGORY CODE, WITHOUT MATERIALISING THE CATEGORY STRINGS PER ROW
+        codes = categories.cat.codes.to_numpy().astype('int64')
+        months = self._months(df)
+        keys = months * len(categories.cat.categories) + codes
+        order = np.argsort(keys, kind = 'stable')
+        present, starts = np.unique(keys[order], return_index = True)
+        for key, positions in zip(present.tolist(), np.split(order, starts[1:])):
+            month, code = divmod(key, len(categories.cat.categories))
+            if self.month is not None and month > self.month:
+                self._close()
+            self.month = month
+            category = categories.cat.categories[code]
+            values = amounts[positions]
+            self._score(rows, positions, values, category)
+            mean = values.mean()
+            self.open_charges.setdefault(category, RunningStats()).merge(len(values), float(mean), float(((values - mean) ** 2).sum()))
+            self.open_sketches.setdefault(category, QuantileSketch()).add_many(values)
+
+        # EACH TOUCHED MONTH'S TOTAL REPLACES ITS OLD VALUE IN THE CATEGORY'S STATISTICS OF MONTHLY TOTALS
+        sums = df['amount_cents'].groupby([categories, df['transaction_year'], df['transaction_month']],
+                                          observed = True, sort = False).sum()
+        for (category, year, month), added in sums.items():
+            key = (category, int(year), int(month))
+            stats = self.monthly.setdefault(category, RunningStats())
+            old = self.month_totals.get(key)
+            new = (old or 0) + int(added)
+            if old is None:
+                stats.add(new)
+            else:
+                stats.replace(old, new)
+            self.month_totals[key] = new
+
+    def _score(self, rows, positions, values, category):
+        stats = self.charges.get(category)
+        if stats is None or stats.count < min(self.warmup_charges, self.min_charges):
+            return
+        sketch = self.sketches[category]
+        if stats.count < self.min_charges:
+            threshold = sketch.maximum()
+        else:
+            threshold = max(stats.mean + self.z_limit * stats.std, sketch.quantile(self.quantile))
+        hits = np.flatnonzero(values > threshold)
+        dates, descriptions = (column[positions[hits]] for column in rows)
+        for date, description, value in zip(dates, descriptions, values[hits]):
+            self.alerts.append({'date' : pd.Timestamp(date),
+                                'description' : description,
+                                'category' : category,
+                                'amount_cents' : int(value),
+                                'mean_cents' : float(stats.mean),
+                                'z' : float((value - stats.mean) / stats.std) if stats.std else float('inf')})
+
+    def charge_alerts(self, limit = None):
+        # Output -> flagged charges, newest first
+        alerts = sorted(self.alerts, key = lambda a : a['date'], reverse = True)
+        return alerts[:limit] if limit else alerts
+
+    def month_alerts(self, budgets = None):
+        # Input -> {category : monthly budget in cents}; Output -> category months over budget or far
+        # above the category's typical month, newest first
+        budgets = budgets or {}
+        alerts = []
+        for (category, year, month), total in self.month_totals.items():
+            reasons = []
+            budget = budgets.get(category)
+            if budget is not None and total > budget:
+                reasons.append('over budget by ${:,.2f}'.format((total - budget) / 100))
+            stats = self.monthly[category]
+            if stats.count >= MIN_MONTHS and stats.std and total > stats.mean + self.month_z_limit * stats.std:
+                reasons.append('{:.1f} sd above a typical ${:,.2f} month'.format((total - stats.mean) / stats.std, stats.mean / 100))
+            if reasons:
+                alerts.append({'year' : year, 'month' : month, 'category' : category, 'total_cents' : total,
+                               'budget_cents' : budget, 'reason' : '; '.join(reasons)})
+        return sorted(alerts, key = lambda a : (a['year'], a['month']), reverse = True)
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+
+# Trailing windows offered by the bank view, in days
+WINDOWS = [7, 30, 90]
+
+
+def daily_balance(ledger):
+    # Input -> bank ledger rows in posting order, with Posting Date / Amount / Balance and optionally account
+    if 'account' in ledger and ledger['account'].nunique() > 1:
+        # EACH ACCOUNT'S BALANCES ONLY ANCHOR ITS OWN ROWS, SO EVERY ACCOUNT GETS ITS OWN DAILY SERIES; THEY ARE
+        # SUMMED OVER THE COMBINED CALENDAR, AN ACCOUNT COUNTING 0 BEFORE ITS FIRST ROW AND ITS LAST BALANCE AFTER
+        parts = [_account_balance(rows) for _, rows in ledger.groupby('account', observed = True, sort = False)]
+        calendar = pd.date_range(min(p.index[0] for p in parts), max(p.index[-1] for p in parts), freq = 'D', name = 'date')
+        return pd.DataFrame({'balance' : sum(p['balance'].reindex(calendar).ffill().fillna(0) for p in parts).round(2),
+                             'net' : sum(p['net'].reindex(calendar, fill_value = 0) for p in parts).round(2)}, index = calendar)
+    return _account_balance(ledger)
+
+
+def _account_balance(ledger):
+    if len(ledger) == 0:
+        return pd.DataFrame({'balance' : pd.Series(dtype = 'float64'), 'net' : pd.Series(dtype = 'float64')},
+                            index = pd.DatetimeIndex([], name = 'date'))
+    amount = (ledger['Amount'].to_numpy(dtype = float) * 100).round().astype('int64')
+    running = np.cumsum(amount)
+
+    # EVERY POSTED BALANCE FIXES THE OPENING BALANCE THE RUNNING SUM OF AMOUNTS STARTS FROM; ROWS WITHOUT
+    # ONE CARRY THE NEAREST EARLIER ANCHOR (OR THE FIRST ONE), SO A BLANK BALANCE IS REBUILT FROM AMOUNTS
+    posted = pd.Series(ledger['Balance'].to_numpy(dtype = float) * 100).round()
+    anchor = (posted - running).ffill().bfill().fillna(0).to_numpy().astype('int64')
+    balance = anchor + running
+
+    # ONE ROW PER CALENDAR DAY: THE DAY'S LAST BALANCE, CARRIED OVER DAYS WITH NO ACTIVITY, AND ITS NET FLOW
+    days = ledger['Posting Date'].dt.normalize().to_numpy()
+    last = np.r_[days[1:] != days[:-1], True]
+    calendar = pd.date_range(days[0], days[-1], freq = 'D', name = 'date')
+    position = np.searchsorted(calendar.to_numpy(), days[last])
+    daily_cents = np.zeros(len(calendar), dtype = 'int64')
+    np.add.at(daily_cents, np.searchsorted(calendar.to_numpy(), days), amount)
+    filled = np.zeros(len(calendar), dtype = 'int64')
+    has_row = np.zeros(len(calendar), dtype = bool)
+    filled[position], has_row[position] = balance[last], True
+    filled = filled[np.maximum.accumulate(np.where(has_row, np.arange(len(calendar)), 0))]
+
+    # Output -> dollars per day, indexed by every date from the first posting to the last
+    return pd.DataFrame({'balance' : filled / 100, 'net' : daily_cents / 100}, index = calendar)
+
+
+def _trailing(values, window):
+    # Output -> values[i] - values[i - window], with values[-k] read as 0 before the series starts
+    shifted = np.r_[np.zeros(min(window, len(values))), values[:-window] if window < len(values) else []]
+    return values - shifted
+
+
+def _window_extreme(values, window, reduce):
+    # TRAILING MIN / MAX BY DOUBLING: AFTER k STEPS EACH SLOT HOLDS THE EXTREME OF 2**k VALUES, AND TWO
+    # OVERLAPPING SPANS OF THE LARGEST POWER OF TWO COVER THE WHOLE WINDOW
+    identity = np.inf if reduce is np.minimum else -np.inf
+    padded = np.r_[np.full(window - 1, identity), values]
+    span, table = 1, padded
+    while span * 2 <= window:
+        table = reduce(table[:-span], table[span:])
+        span *= 2
+    return reduce(table[:len(values)], table[window - span : window - span + len(values)])
+
+
+def rolling_metrics(daily, window = 30):
+    # Input -> daily_balance() output and a trailing window in days
+    balance = daily['balance'].to_numpy()
+    days = np.minimum(np.arange(1, len(daily) + 1), window)
+    # SUMS OVER THE WINDOW COME FROM DIFFERENCES OF ONE CUMULATIVE SUM, SO EVERY WINDOW IS ONE PASS
+    flow = _trailing(np.cumsum(daily['net'].to_numpy()), window)
+    average = _trailing(np.cumsum(balance), window) / days
+    # Output -> per day: net flow, average daily balance, and min / max balance over the trailing window
+    return pd.DataFrame({'net_flow' : flow.round(2),
+                         'average_balance' : average,
+                         'min_balance' : _window_extreme(balance, window, np.minimum),
+                         'max_balance' : _window_extreme(balance, window, np.maximum)}, index = daily.index)
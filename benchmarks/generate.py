@@ -0,0 +1,155 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# Merchants per category, shaped like the descriptions in the real Chase exports
+MERCHANTS = {
+    'Food & Drink' : ['CHICK-FIL-A #{:05d}', 'STARBUCKS STORE {:05d}', 'UBER   EATS', 'SANTI THAI FUSION', 'THE HALAL GUYS #{:03d}', 'DOORDASH*{:04d}'],
+    'Groceries' : ['TRADER JOE S #{:03d}', 'WHOLEFDS GIL #{:05d}', 'SAFEWAY #{:04d}', '99 RANCH #{:04d}'],
+    'Gas' : ['COSTCO GAS #{:04d}', '7-ELEVEN {:05d}', 'CHEVRON {:07d}', 'SHELL OIL {:09d}'],
+    'Shopping' : ['AMZN Mktp US*{:09d}', 'PAYPAL *NIKE.COM', 'TARGET        {:08d}', 'ADIDAS US ONLINE STORE'],
+    'Entertainment' : ['PAYPAL *TICKETMASTE TI', 'SPOTIFY USA', 'NETFLIX.COM', 'AMC {:04d} ONLINE'],
+    'Bills & Utilities' : ['PG&E WEBRECURRING', 'COMCAST CALIFORNIA', 'T-MOBILE*AUTO PAY', 'VERIZON WRLS {:05d}'],
+    'Travel' : ['UBER   TRIP', 'LYFT   *RIDE', 'UNITED {:013d}', 'BART-CLIPPER {:04d}'],
+    'Health & Wellness' : ['KAISER {:08d}', 'CVS/PHARMACY #{:05d}', 'WALGREENS #{:05d}'],
+    'Education' : ['UC BERKELEY BOOKSTORE', 'CHEGG ORDER', 'COURSERA {:06d}'],
+    'Home' : ['IKEA EAST PALO ALTO', 'HOME DEPOT #{:04d}', 'BED BATH & BEYOND #{:03d}'],
+    'Personal' : ['GREAT CLIPS # {:04d}', 'SUPERCUTS {:05d}'],
+    'Fees & Adjustments' : ['LATE FEE', 'FOREIGN TRANSACTION FEE'],
+}
+
+BANK_COLUMNS = ['Details', 'Posting Date', 'Description', 'Amount', 'Type', 'Balance', 'Check or Slip #']
+
+
+def _format_dates(dates):
+    # FORMATTING EACH DISTINCT DAY ONCE IS FAR CHEAPER THAN strftime OVER MILLIONS OF ROWS
+    days, inverse = np.unique(dates.values.astype('datetime64[D]'), return_inverse = True)
+    return pd.DatetimeIndex(days).strftime('%m/%d/%Y').to_numpy()[inverse]
+
+
+def _descriptions(rng, templates, size):
+    # Output -> one description per row, with store numbers filled in from a small pool per template
+    pick = rng.integers(0, len(templates), size)
+    out = np.empty(size, dtype = object)
+    for i, template in enumerate(templates):
+        rows = np.flatnonzero(pick == i)
+        if '{' in template:
+            variants = np.array([template.format(n) for n in rng.integers(1, 10 ** 4, 8)], dtype = object)
+            out[rows] = variants[rng.integers(0, len(variants), len(rows))]
+        else:
+            out[rows] = template
+    return out
+
+
+def credit_statement(rows, start = '2015-01-01', end = '2024-12-31', categories = None, seed = 0):
+    # Output -> DataFrame in the flex.csv / unlimited.csv export layout, newest first
+    rng = np.random.default_rng(seed)
+    categories = categories or list(MERCHANTS)
+    span = (pd.Timestamp(end) - pd.Timestamp(start)).days
+    dates = pd.Timestamp(start) + pd.to_timedelta(np.sort(rng.integers(0, span + 1, rows)), unit = 'D')
+    dates = pd.Series(dates)
+
+    category = np.array(categories, dtype = object)[rng.integers(0, len(categories), rows)]
+    description = np.empty(rows, dtype = object)
+    for name in categories:
+        mask = category == name
+        description[mask] = _descriptions(rng, MERCHANTS.get(name, [name.upper() + ' {:04d}']), int(mask.sum()))
+    amount = -np.round(rng.lognormal(3.0, 1.0, rows), 2)
+    kind = np.full(rows, 'Sale', dtype = object)
+
+    # ABOUT 2% RETURNS AND 1% CARD PAYMENTS, WHICH get_credit_data FILTERS OUT
+    returns = rng.random(rows) < 0.02
+    amount[returns] *= -1
+    kind[returns] = 'Return'
+    payments = rng.random(rows) < 0.01
+    amount[payments] = np.round(rng.uniform(100, 3000, int(payments.sum())), 2)
+    kind[payments] = 'Payment'
+    description[payments] = 'Payment Thank You-Mobile'
+    category[payments] = None
+
+    post = dates + pd.to_timedelta(rng.integers(0, 3, rows), unit = 'D')
+    df = pd.DataFrame({'Transaction Date' : _format_dates(dates),
+                       'Post Date' : _format_dates(post),
+                       'Description' : description,
+                       'Category' : category,
+                       'Type' : kind,
+                       'Amount' : amount,
+                       'Memo' : None})
+    return df.iloc[::-1].reset_index(drop = True)
+
+
+def bank_statement(rows, start = '2015-01-01', end = '2024-12-31', opening_balance = 5000.0, seed = 0):
+    # Output -> DataFrame in the bank_account.csv export layout (running balance, newest first)
+    rng = np.random.default_rng(seed)
+    span = (pd.Timestamp(end) - pd.Timestamp(start)).days
+    dates = pd.Series(pd.Timestamp(start) + pd.to_timedelta(np.sort(rng.integers(0, span + 1, rows)), unit = 'D'))
+
+    kinds = np.array(['DEBIT_CARD', 'ACH_DEBIT', 'ATM', 'FEE_TRANSACTION', 'ACCT_XFER', 'ACH_CREDIT', 'QUICKPAY_CREDIT'], dtype = object)
+    kind = kinds[rng.choice(len(kinds), rows, p = [0.45, 0.15, 0.05, 0.02, 0.08, 0.15, 0.10])]
+    credit = np.isin(kind, ['ACH_CREDIT', 'QUICKPAY_CREDIT'])
+    amount = np.where(credit, np.round(rng.lognormal(6.0, 0.8, rows), 2), -np.round(rng.lognormal(3.5, 1.0, rows), 2))
+    amount[kind == 'FEE_TRANSACTION'] = -3.00
+
+    description = np.empty(rows, dtype = object)
+    description[kind == 'DEBIT_CARD'] = _descriptions(rng, sum(MERCHANTS.values(), []), int((kind == 'DEBIT_CARD').sum()))
+    description[kind == 'ACH_DEBIT'] = 'CAPITAL ONE      CRCARDPMT                  PPD ID: 9541719318'
+    description[kind == 'ATM'] = 'NON-CHASE ATM WITHDRAW'
+    description[kind == 'FEE_TRANSACTION'] = 'NON-CHASE ATM FEE-WITH'
+    description[kind == 'ACCT_XFER'] = 'Autosave TZ Savings 11067043759'
+    description[kind == 'ACH_CREDIT'] = 'INTER BUS MACH   IBMSUPPAYS                 PPD ID: 1130871985'
+    description[kind == 'QUICKPAY_CREDIT'] = 'Zelle payment from FRIEND'
+
+    # SCALING INCOME TO RUN JUST AHEAD OF SPENDING SO THE BALANCE DRIFTS GENTLY UPWARD OVER THE PERIOD
+    amount[credit] *= -amount[~credit].sum() * 1.02 / max(amount[credit].sum(), 1.0)
+    amount = np.round(amount, 2)
+    balance = np.round(opening_balance + np.cumsum(amount), 2)
+
+    df = pd.DataFrame({'Details' : np.where(amount > 0, 'CREDIT', 'DEBIT'),
+                       'Posting Date' : _format_dates(dates),
+                       'Description' : description,
+                       'Amount' : amount,
+                       'Type' : kind,
+                       'Balance' : balance,
+                       'Check or Slip #' : None})
+    return df.iloc[::-1].reset_index(drop = True)
+
+
+def write_bank_csv(df, path):
+    # THE REAL EXPORT ENDS EVERY ROW WITH ONE MORE EMPTY FIELD THAN THE HEADER HAS; get_bank_data RELIES ON index_col=False FOR IT
+    with open(path, 'w', newline = '') as f:
+        f.write(','.join(BANK_COLUMNS) + '\n')
+        df.assign(_trailing = None).to_csv(f, header = False, index = False)
+
+
+def generate(directory, credit_rows, bank_rows, accounts = 2, start = '2015-01-01', end = '2024-12-31', seed = 0):
+    # Input -> output directory, total credit rows (split across `accounts` card exports) and bank rows
+    os.makedirs(directory, exist_ok = True)
+    paths = []
+    for i in range(accounts):
+        rows = credit_rows // accounts + (1 if i < credit_rows % accounts else 0)
+        path = os.path.join(directory, 'card_{}.csv'.format(i + 1))
+        credit_statement(rows, start, end, seed = seed + i).to_csv(path, index = False)
+        paths.append(path)
+    path = os.path.join(directory, 'bank_account.csv')
+    write_bank_csv(bank_statement(bank_rows, start, end, seed = seed + accounts), path)
+    paths.append(path)
+    # Output -> paths of every csv written
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Write synthetic credit card and bank statement csvs.')
+    parser.add_argument('directory')
+    parser.add_argument('--credit-rows', type = int, default = 10000)
+    parser.add_argument('--bank-rows', type = int, default = None, help = 'defaults to a quarter of --credit-rows')
+    parser.add_argument('--accounts', type = int, default = 2, help = 'number of credit card exports')
+    parser.add_argument('--start', default = '2015-01-01')
+    parser.add_argument('--end', default = '2024-12-31')
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+    bank_rows = args.bank_rows if args.bank_rows is not None else max(args.credit_rows // 4, 1)
+    for path in generate(args.directory, args.credit_rows, bank_rows, args.accounts, args.start, args.end, args.seed):
+        print(path)
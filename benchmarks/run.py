@@ -0,0 +1,193 @@
+import argparse
+import inspect
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from generate import generate
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def summarize(seconds):
+    # Output -> latency percentiles in milliseconds
+    ms = np.asarray(seconds) * 1000
+    return {'n' : int(len(ms)),
+            'mean_ms' : round(float(ms.mean()), 3),
+            'p50_ms' : round(float(np.percentile(ms, 50)), 3),
+            'p90_ms' : round(float(np.percentile(ms, 90)), 3),
+            'p99_ms' : round(float(np.percentile(ms, 99)), 3),
+            'min_ms' : round(float(ms.min()), 3),
+            'max_ms' : round(float(ms.max()), 3)}
+
+
+def peak_bytes(func, *args):
+    # ONE EXTRA TRACED CALL, SO tracemalloc OVERHEAD NEVER LEAKS INTO THE TIMINGS
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(func, arg_sets, repeat):
+    # Input -> a function, the argument tuples to call it with, and how often to repeat each
+    seconds = []
+    for args in arg_sets:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(*args)
+            seconds.append(time.perf_counter() - start)
+    result = summarize(seconds)
+    result['peak_bytes'] = max(peak_bytes(func, *args) for args in arg_sets)
+    return result
+
+
+def filter_matrix(snapshot):
+    # Output -> dropdown / date-range combinations shared by every callback benchmark
+    years = snapshot.years
+    categories = snapshot.categories
+    mid = years[len(years) // 2]
+    return {'year' : [None, years[0], years[-1]],
+            'month' : [None, 'March'],
+            'category' : [None, categories[0]],
+            'range' : [(None, None), ('{}-02-10'.format(mid), '{}-09-20'.format(mid))]}
+
+
+def run_worker(data_dir, repeat):
+    # Runs inside a fresh interpreter pointed at data_dir, so import-time startup is measured cold
+    sys.path.insert(0, ROOT)
+    started = time.perf_counter()
+    import Dashboard as D
+    startup = time.perf_counter() - started
+
+    from dataset import StatementStore
+    from sqlite_store import SqliteStatementStore
+    results = {'startup_cold' : {'seconds' : round(startup, 3)}}
+    started = time.perf_counter()
+    if D.sqlite_path:
+        SqliteStatementStore(data_dir, D.sqlite_path, D.get_credit_data, D.get_bank_data, D.bank_summary)
+    else:
+        StatementStore(data_dir, D.get_credit_data, D.get_bank_data, D.bank_summary)
+    results['startup_warm_cache'] = {'seconds' : round(time.perf_counter() - started, 3)}
+
+    snapshot = D.store.snapshot
+    credit_files = sorted(p for p, f in D.store.files.items() if f['kind'] == 'credit')
+    bank_files = sorted(p for p, f in D.store.files.items() if f['kind'] == 'bank')
+    ingest_repeat = max(1, repeat // 2)
+    results['get_credit_data'] = measure(D.get_credit_data, [(p,) for p in credit_files], ingest_repeat)
+    results['get_bank_data'] = measure(D.get_bank_data, [(p,) for p in bank_files], ingest_repeat)
+    if snapshot.transactions_df is not None:
+        results['end_of_month'] = measure(D.end_of_month, [(snapshot.transactions_df,)], repeat)
+
+    m = filter_matrix(snapshot)
+    combos = list(itertools.product(m['range'], m['category'], m['year'], m['month']))
+    callbacks = {
+        'piechart_update' : [(y, mo) for y, mo in itertools.product(m['year'], m['month'])],
+        'datatable_update' : [(s, e, c, y, mo) for (s, e), c, y, mo in combos]
+                             + [(None, None, None, None, None, 3, 10, [{'column_id' : 'Amount ($)', 'direction' : 'desc'}], ''),
+                                (None, None, None, None, None, 0, 10, None, '{Description} contains "nike" && {Amount ($)} > 20')],
+        'linechart_update' : [(s, e, c, y, mo) for (s, e), c, y, mo in combos],
+        'monthsum_update' : [(s, e, c, y, g) for ((s, e), c, y, mo), g in itertools.product(combos, ['month', 'week']) if mo is None],
+        'bank_update' : [(g,) for g in ['day', 'week', 'month', 'quarter', 'year']],
+        'rolling_update' : [(w,) for w in [7, 30, 90]],
+        'recurring_update' : [()],
+        'alerts_update' : [()],
+    }
+    for name, arg_sets in callbacks.items():
+        # CALLING THE UNDERLYING FUNCTION SO THE FIGURE CACHE NEVER TURNS A BENCHMARK INTO A LOOKUP
+        results[name] = measure(inspect.unwrap(getattr(D, name)), arg_sets, repeat)
+
+    return {'rows' : {'transactions' : len(snapshot.transactions), 'ledger' : len(snapshot.ledger)},
+            'max_rss_kb' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'results' : results}
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = ROOT, capture_output = True, text = True).stdout.strip()
+    except OSError:
+        commit = None
+    import pandas
+    return {'commit' : commit,
+            'python' : platform.python_version(),
+            'pandas' : pandas.__version__,
+            'numpy' : np.__version__,
+            'platform' : platform.platform(),
+            'cpus' : os.cpu_count()}
+
+
+def compare(current, baseline):
+    # PRINTS p50 RATIOS (current / baseline) FOR EVERY BENCHMARK PRESENT IN BOTH RUNS; > 1 MEANS SLOWER
+    old = {(r['credit_rows'], name) : v for r in baseline['runs'] for name, v in r['results'].items()}
+    for run in current['runs']:
+        for name, v in run['results'].items():
+            before = old.get((run['credit_rows'], name))
+            if before is None:
+                continue
+            key = 'p50_ms' if 'p50_ms' in v else 'seconds'
+            ratio = v[key] / before[key] if before[key] else float('nan')
+            print('{:>10} {:<22} {:>10.3f} -> {:>10.3f} {:>6.2f}x'.format(run['credit_rows'], name, before[key], v[key], ratio))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark ingestion and callbacks on synthetic statements.')
+    parser.add_argument('--rows', type = int, nargs = '+', default = [10000, 100000], help = 'credit rows per run, e.g. 10000 1000000 10000000')
+    parser.add_argument('--bank-ratio', type = float, default = 0.25, help = 'bank rows as a fraction of credit rows')
+    parser.add_argument('--accounts', type = int, default = 2)
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--out', default = None, help = 'JSON results path (default benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--baseline', default = None, help = 'earlier results JSON to compare against')
+    parser.add_argument('--sqlite', action = 'store_true', help = 'benchmark the SQLite backend instead of the in-memory one')
+    parser.add_argument('--worker', default = None, help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.repeat)))
+        sys.exit(0)
+
+    report = {'environment' : environment(), 'seed' : args.seed, 'repeat' : args.repeat,
+              'backend' : 'sqlite' if args.sqlite else 'memory', 'runs' : []}
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = os.path.join(tmp, 'statements')
+            generate(data_dir, rows, max(int(rows * args.bank_ratio), 1), args.accounts, seed = args.seed)
+            env = dict(os.environ,
+                       DASHBOARD_STATEMENTS_DIR = data_dir,
+                       DASHBOARD_CACHE_DIR = os.path.join(tmp, 'cache'),
+                       DASHBOARD_RELOAD_SECONDS = '0')
+            env.pop('DASHBOARD_FIGURE_CACHE_DIR', None)
+            env.pop('DASHBOARD_SQLITE_PATH', None)
+            if args.sqlite:
+                env['DASHBOARD_SQLITE_PATH'] = os.path.join(tmp, 'transactions.sqlite')
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', data_dir, '--repeat', str(args.repeat)],
+                                  cwd = ROOT, env = env, capture_output = True, text = True)
+            if proc.returncode != 0:
+                sys.stderr.write(proc.stderr)
+                sys.exit(proc.returncode)
+            run = json.loads(proc.stdout.strip().splitlines()[-1])
+            run.update({'credit_rows' : rows, 'bank_rows' : max(int(rows * args.bank_ratio), 1), 'accounts' : args.accounts})
+            report['runs'].append(run)
+            print('{:>10} rows: startup {:.2f}s, max rss {:.0f} MB'.format(rows, run['results']['startup_cold']['seconds'], run['max_rss_kb'] / 1024))
+
+    out = args.out or os.path.join(ROOT, 'benchmarks', 'results', time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok = True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent = 2)
+    print('results written to', out)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
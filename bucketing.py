@@ -0,0 +1,36 @@
+import pandas as pd
+
+
+# Granularity -> pandas period frequency. Weeks run Monday to Sunday.
+GRANULARITIES = {'day' : 'D',
+                 'week' : 'W-SUN',
+                 'month' : 'M',
+                 'quarter' : 'Q',
+                 'year' : 'Y'}
+
+
+def bucket(dates, granularity = 'month', label = 'start'):
+    # Input -> Series of datetimes, one of GRANULARITIES, and whether to label a bucket by its first or last day
+    periods = pd.Series(dates).dt.to_period(GRANULARITIES[granularity])
+    if label == 'end':
+        labels = periods.dt.end_time.dt.normalize()
+    else:
+        labels = periods.dt.start_time
+    # Output -> Series (same index as dates) with the bucket label of every row
+    return labels
+
+
+def bucket_sum(df, date_col, value_col, granularity = 'month', label = 'end'):
+    # Output -> one row per non-empty bucket: [date_col = bucket label, value_col = summed value]
+    keys = bucket(df[date_col], granularity, label).rename(date_col)
+    return df[value_col].groupby(keys).sum().reset_index()
+
+
+def bucket_last(df, date_col, granularity = 'month', label = 'start', label_col = 'Bucket'):
+    # Input -> rows already in chronological order
+    keys = bucket(df[date_col], granularity, label)
+    last = ~keys.duplicated(keep = 'last')
+    out = df[last.to_numpy()].copy()
+    out.insert(0, label_col, keys[last].to_numpy())
+    # Output -> the final row of every bucket with its bucket label in label_col
+    return out.reset_index(drop = True)
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import shutil
+
+import pandas as pd
+
+
+# Cleaned frames are written here as parquet, one directory per (loader, source file) fingerprint.
+# Bump CACHE_VERSION whenever a loader changes the shape of what it returns.
+CACHE_DIR = os.environ.get('DASHBOARD_CACHE_DIR', '.dashboard_cache')
+CACHE_VERSION = 3
+
+# (path, size, mtime) -> fingerprint, so a file is hashed at most once per process while unchanged
+_fingerprints = {}
+
+
+def file_fingerprint(path, chunk_size = 1 << 20):
+    # Input -> string format of csv location
+    stat = os.stat(path)
+    seen = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if seen in _fingerprints:
+        return _fingerprints[seen]
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    # Output -> everything that identifies the exact bytes a cache entry was built from
+    _fingerprints[seen] = {'path' : os.path.abspath(path),
+                           'size' : stat.st_size,
+                           'mtime' : stat.st_mtime_ns,
+                           'sha1' : digest.hexdigest()}
+    return _fingerprints[seen]
+
+
+def dataset_version(fingerprints):
+    # Input -> file_fingerprint() of every source; Output -> short id identical in every process reading the same files
+    digests = sorted(fingerprint['sha1'] for fingerprint in fingerprints)
+    return hashlib.sha1(json.dumps([CACHE_VERSION] + digests).encode()).hexdigest()[:16]
+
+
+def _read_manifest(entry):
+    try:
+        with open(os.path.join(entry, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _prune_stale(cache_dir, loader_name, path, keep):
+    # DROPPING OLDER ENTRIES FOR THE SAME SOURCE SO THE CACHE DOES NOT GROW WITH EVERY EDIT
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        if name == keep or not os.path.isdir(entry):
+            continue
+        manifest = _read_manifest(entry)
+        if manifest and manifest['loader'] == loader_name and manifest['source']['path'] == path:
+            shutil.rmtree(entry, ignore_errors = True)
+
+
+def cached_load(loader, path, cache_dir = CACHE_DIR):
+    # Input -> a loader such as get_credit_data / get_bank_data (returning a frame or a tuple of frames) and its csv
+    fingerprint = file_fingerprint(path)
+    key = hashlib.sha1(json.dumps([CACHE_VERSION, loader.__name__, fingerprint], sort_keys = True).encode()).hexdigest()
+    entry = os.path.join(cache_dir, key)
+
+    manifest = _read_manifest(entry)
+    if manifest is not None:
+        try:
+            frames = tuple(pd.read_parquet(os.path.join(entry, '{}.parquet'.format(i))) for i in range(manifest['frames']))
+            return frames[0] if manifest.get('single') else frames
+        except (ImportError, OSError, TypeError, ValueError):
+            pass
+
+    result = loader(path)
+    single = isinstance(result, pd.DataFrame)
+    frames = (result,) if single else result
+
+    # WRITING TO A TEMPORARY DIRECTORY FIRST SO A CRASHED WRITE NEVER LEAVES A HALF-VALID ENTRY
+    os.makedirs(cache_dir, exist_ok = True)
+    tmp = entry + '.tmp{}'.format(os.getpid())
+    try:
+        os.makedirs(tmp, exist_ok = True)
+        for i, frame in enumerate(frames):
+            frame.to_parquet(os.path.join(tmp, '{}.parquet'.format(i)))
+        with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+            json.dump({'loader' : loader.__name__, 'source' : fingerprint, 'frames' : len(frames), 'single' : single}, f)
+        shutil.rmtree(entry, ignore_errors = True)
+        os.replace(tmp, entry)
+        _prune_stale(cache_dir, loader.__name__, fingerprint['path'], key)
+    except (ImportError, OSError, TypeError, ValueError):
+        # pyarrow missing or cache dir not writable -> serve the freshly parsed frames uncached
+        shutil.rmtree(tmp, ignore_errors = True)
+
+    # Output -> exactly what the loader returns
+    return result
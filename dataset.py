@@ -0,0 +1,328 @@
+import copy
+import glob
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+from anomalies import AnomalyDetector
+from balance_history import daily_balance
+from data_cache import cached_load, dataset_version, file_fingerprint
+from merchants import bank_spending_rows
+from query_engine import TransactionIndex
+from search_index import DescriptionIndex
+from spending_cube import SpendingCube
+
+
+# Columns that identify the same real transaction across overlapping statement exports. Every row also
+# carries the account its export belongs to, so identical rows on two cards or bank accounts are both kept.
+CREDIT_KEYS = ['account', 'transaction_date', 'description', 'category', 'type', 'amount_cents']
+BANK_KEYS = ['account', 'Details', 'Posting Date', 'Description', 'Amount', 'Type', 'Balance']
+OCCURRENCE = 'occurrence'
+
+# Date stamps, date ranges and download copy markers in an export's file name, which differ between
+# exports of one account ('Chase1234_Activity20230101_20230331.csv', 'flex_2022.csv', 'flex (1).csv')
+_EXPORT_SUFFIX = re.compile(r'(?:[ _-]+activity.*|[ _-]*\(\d+\)|[ _-]+[\d-]*\d{4}[\d-]*)+$', re.IGNORECASE)
+
+
+def statement_kind(path):
+    # Input -> csv path; Output -> 'credit', 'bank' or None, judged from the export's header row
+    try:
+        with open(path, newline = '') as f:
+            header = f.readline()
+    except (OSError, UnicodeDecodeError):
+        return None
+    if 'Transaction Date' in header and 'Post Date' in header:
+        return 'credit'
+    if 'Posting Date' in header and 'Balance' in header:
+        return 'bank'
+    return None
+
+
+def statement_account(path):
+    # Output -> the account an export belongs to:  its file name without export dates or copy markers
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return _EXPORT_SUFFIX.sub('', stem) or stem
+
+
+def tag_occurrences(df, keys):
+    # NUMBERING REPEATS OF A KEY WITHIN ONE FILE, SO TWO IDENTICAL COFFEES ON ONE DAY SURVIVE DEDUPLICATION
+    # WHILE THE SAME COFFEE EXPORTED IN TWO OVERLAPPING FILES DOES NOT
+    df = df.copy()
+    df[OCCURRENCE] = df.groupby(keys, dropna = False, sort = False, observed = True).cumcount().astype('int32')
+    return df
+
+
+def concat_frames(frames):
+    # pd.concat FALLS BACK TO object WHEN CATEGORIES DIFFER BETWEEN FILES, SO EVERY FRAME IS FIRST GIVEN THE
+    # UNION OF THE CATEGORIES, WHICH ONLY REMAPS INTEGER CODES; COLUMNS CATEGORICAL IN SOME FRAMES ONLY ARE
+    # RE-ENCODED AFTERWARDS. EMPTY FRAMES (AN APPEND THAT ADDED NO NEW ROWS) ARE LEFT OUT SO THEY CANNOT
+    # CHANGE THE DTYPES
+    frames = [f for f in frames if len(f)] or frames[:1]
+    for col in frames[0].columns:
+        if not all(col in f and isinstance(f[col].dtype, pd.CategoricalDtype) for f in frames):
+            continue
+        categories = frames[0][col].cat.categories
+        for f in frames[1:]:
+            categories = categories.union(f[col].cat.categories)
+        recoded = []
+        for f in frames:
+            if not f[col].cat.categories.equals(categories):
+                f = f.copy(deep = False)
+                f[col] = f[col].cat.set_categories(categories)
+            recoded.append(f)
+        frames = recoded
+    df = pd.concat(frames, ignore_index = True)
+    for col in frames[0].columns:
+        if isinstance(frames[0][col].dtype, pd.CategoricalDtype) and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return df
+
+
+def memory_report(df, name = ''):
+    # Output -> one row per column with its dtype and deep memory use, largest first
+    usage = df.memory_usage(deep = True, index = False)
+    report = pd.DataFrame({'frame' : name,
+                           'column' : usage.index,
+                           'dtype' : [str(df[c].dtype) for c in usage.index],
+                           'bytes' : usage.values})
+    report['bytes_per_row'] = (report['bytes'] / max(len(df), 1)).round(2)
+    return report.sort_values('bytes', ascending = False).reset_index(drop = True)
+
+
+def new_rows(existing, incoming, keys, date_col = None):
+    # Output -> rows of incoming whose (keys, occurrence) is not already in existing
+    if len(existing) == 0 or len(incoming) == 0:
+        return incoming
+    if date_col is not None:
+        # existing IS SORTED BY date_col, SO ONLY ITS ROWS INSIDE THE INCOMING DATE SPAN, FOUND BY BINARY SEARCH,
+        # CAN MATCH; THE REST OF THE HISTORY IS NEVER TOUCHED
+        dates, span = existing[date_col].to_numpy(), incoming[date_col].to_numpy()
+        existing = existing.iloc[np.searchsorted(dates, span.min(), side = 'left'):np.searchsorted(dates, span.max(), side = 'right')]
+        if len(existing) == 0:
+            return incoming
+    seen = existing[keys + [OCCURRENCE]].drop_duplicates()
+    merged = incoming.merge(seen, on = keys + [OCCURRENCE], how = 'left', indicator = True)
+    return incoming[(merged['_merge'] == 'left_only').to_numpy()]
+
+
+def insert_sorted(previous, fresh, date_col):
+    # Input -> two frames each sorted by date_col
+    # Output -> (both in one frame sorted by date_col, positions of fresh's rows in it); a fresh row goes
+    #           after the previous rows of its date, as a stable sort of the concatenation would put it
+    if len(fresh) == 0:
+        return previous, np.arange(0, dtype = np.intp)
+    slots = np.searchsorted(previous[date_col].to_numpy(), fresh[date_col].to_numpy(), side = 'right')
+    added = slots + np.arange(len(fresh))
+    df = concat_frames([previous, fresh])
+    if slots[0] < len(previous):
+        # NEW ROWS BEFORE THE END OF THE HISTORY: ONE GATHER PUTS EVERY ROW IN PLACE, WITHOUT A SORT
+        order = np.empty(len(df), dtype = np.intp)
+        keep = np.ones(len(df), dtype = bool)
+        keep[added] = False
+        order[keep] = np.arange(len(previous))
+        order[added] = len(previous) + np.arange(len(fresh))
+        df = df.take(order).reset_index(drop = True)
+    return df, added
+
+
+def merge_statements(frames, keys, date_col):
+    # Output -> one chronological frame with rows shared by overlapping exports kept once
+    if not frames:
+        return None
+    df = concat_frames(frames)
+    df = df.drop_duplicates(keys + [OCCURRENCE])
+    return df.sort_values(date_col, kind = 'mergesort').reset_index(drop = True)
+
+
+class Dataset:
+    # Immutable snapshot of everything the callbacks read. A reload builds a new Dataset and swaps the
+    # reference, so a request holding the old one keeps a consistent view until it finishes.
+    # transactions_df is None when transactions / spending are backed by a database rather than memory.
+    def __init__(self, transactions_df, ledger, balance, income, version, spending = None, transactions = None, anomalies = None):
+        self.transactions_df = transactions_df
+        self.transactions = transactions if transactions is not None else TransactionIndex(transactions_df)
+        self.spending = spending if spending is not None else SpendingCube(transactions_df)
+        if anomalies is None:
+            anomalies = AnomalyDetector()
+            if transactions_df is not None:
+                anomalies.add(transactions_df)
+        self.anomalies = anomalies
+        # BANK DEBITS BY THE CATEGORY THE MERCHANT RULES GAVE THEM, FOR THE PIE CHART
+        self.bank_spending = SpendingCube(bank_spending_rows(ledger))
+        # ONE ROW PER CALENDAR DAY OF THE BANK HISTORY, WHICH THE ROLLING-WINDOW CHARTS ARE COMPUTED FROM
+        self.daily_balance = daily_balance(ledger)
+        self.ledger = ledger
+        self.balance = balance
+        self.income = income
+        self.version = version
+        self.years = self.transactions.years()
+        self.categories = self.transactions.categories()
+
+    def memory_report(self):
+        # Output -> per-column memory use of the row-level frames held by this snapshot
+        frames = [memory_report(self.ledger, 'ledger')]
+        if self.transactions_df is not None:
+            frames.insert(0, memory_report(self.transactions_df, 'transactions'))
+        return pd.concat(frames, ignore_index = True)
+
+
+class StatementStore:
+    # Keeps the parsed frames of every statement csv in a directory. refresh() re-parses only files
+    # that are new or changed since the last call and then swaps in a new Dataset snapshot.
+    # With load=False nothing is parsed until the first refresh(), and snapshot stays None until then.
+    # A MerchantCategorizer, when given, fills uncategorised card rows and tags bank rows as they are parsed.
+    # detector is an empty AnomalyDetector carrying the spending alert thresholds; every snapshot's alerts
+    # are scored with its settings.
+    def __init__(self, directory, credit_loader, bank_loader, bank_summary, load = True, categorizer = None, detector = None):
+        self.directory = directory
+        self.credit_loader = credit_loader
+        self.bank_loader = bank_loader
+        self.bank_summary = bank_summary
+        self.categorizer = categorizer
+        self.detector = detector or AnomalyDetector()
+        self.files = {}
+        # FINGERPRINTS OF EXPORTS THAT FAILED TO PARSE; ONE IS ONLY TRIED AGAIN ONCE ITS FINGERPRINT CHANGES
+        self.failed = {}
+        self.snapshot = None
+        self.listeners = []
+        self.ready = threading.Event()
+        # ONE SEARCH INDEX FOR THE STORE'S LIFETIME, SO EACH RELOAD ONLY INDEXES DESCRIPTIONS IT HAS NOT SEEN
+        self.descriptions = DescriptionIndex()
+        self._lock = threading.Lock()
+        if load:
+            self.refresh()
+
+    def _scan(self):
+        found = {}
+        for path in sorted(glob.glob(os.path.join(self.directory, '*.csv'))):
+            kind = statement_kind(path)
+            if kind is None:
+                continue
+            try:
+                found[path] = (kind, file_fingerprint(path))
+            except OSError:
+                continue
+        return found
+
+    def _categorize(self, frame, kind):
+        # RULES ARE APPLIED AFTER THE PARQUET CACHE, SO EDITING THEM NEVER INVALIDATES PARSED STATEMENTS
+        if self.categorizer is None:
+            return frame
+        if kind == 'credit':
+            return self.categorizer.fill_categories(frame)
+        return self.categorizer.tag(frame)
+
+    def _parse_credit(self, path):
+        df = self._categorize(cached_load(self.credit_loader, path), 'credit')
+        df = df.assign(account = pd.Categorical([statement_account(path)] * len(df)))
+        return tag_occurrences(df, CREDIT_KEYS)
+
+    def _parse_bank(self, path):
+        df = self._categorize(cached_load(self.bank_loader, path)[2], 'bank')
+        df = df.assign(account = pd.Categorical([statement_account(path)] * len(df)))
+        return tag_occurrences(df, BANK_KEYS)
+
+    def _parse(self, path, kind):
+        if kind == 'credit':
+            return self._parse_credit(path)
+        return self._parse_bank(path)
+
+    def _version(self, files):
+        fingerprints = [f['fingerprint'] for f in files.values()]
+        if self.categorizer is not None:
+            fingerprints.append(self.categorizer.fingerprint)
+        fingerprints.append(self.detector.fingerprint)
+        return dataset_version(fingerprints)
+
+    def refresh(self):
+        # Output -> True when a new snapshot was swapped in
+        with self._lock:
+            found = self._scan()
+            self.failed = {p : f for p, f in self.failed.items() if p in found}
+            changed = [p for p in found if (p not in self.files or self.files[p]['fingerprint'] != found[p][1])
+                       and self.failed.get(p) != found[p][1]]
+            removed = [p for p in self.files if p not in found]
+            if self.snapshot is not None and not changed and not removed:
+                return False
+
+            parsed = {}
+            for path in changed:
+                kind, fingerprint = found[path]
+                try:
+                    parsed[path] = {'kind' : kind, 'fingerprint' : fingerprint, 'frame' : self._parse(path, kind)}
+                    self.failed.pop(path, None)
+                except (OSError, KeyError, ValueError):
+                    # A HALF-WRITTEN OR MALFORMED EXPORT IS SKIPPED AND RETRIED ONCE ITS FINGERPRINT CHANGES AGAIN;
+                    # AN EARLIER GOOD VERSION OF IT STAYS LOADED MEANWHILE
+                    self.failed[path] = fingerprint
+            if self.snapshot is not None and not parsed and not removed:
+                return False
+            appended_only = self.snapshot is not None and not removed and all(p not in self.files for p in parsed)
+
+            files = {p : f for p, f in self.files.items() if p not in removed}
+            files.update(parsed)
+            snapshot = self._build(files, parsed if appended_only else None)
+            self.files = files
+            self.snapshot = snapshot
+
+        try:
+            for listener in self.listeners:
+                listener(snapshot)
+        finally:
+            self.ready.set()
+        return True
+
+    def _build(self, files, appended):
+        credit = [f['frame'] for p, f in sorted(files.items()) if f['kind'] == 'credit']
+        bank = [f['frame'] for p, f in sorted(files.items()) if f['kind'] == 'bank']
+        if not credit or not bank:
+            raise ValueError('{} needs at least one credit card and one bank statement csv'.format(self.directory))
+        version = self._version(files)
+
+        spending = anomalies = None
+        if appended is not None:
+            # PURE APPEND: ONLY THE NEW FILES' ROWS ARE DEDUPLICATED (AGAINST THE HISTORY OF THEIR OWN DATES),
+            # MERGED INTO PLACE AND ADDED TO COPIES OF THE INDEX, SPENDING CUBE AND ALERT STATISTICS
+            previous = self.snapshot.transactions_df
+            fresh = [new_rows(previous, f['frame'], CREDIT_KEYS, 'transaction_date') for f in appended.values() if f['kind'] == 'credit']
+            fresh = merge_statements(fresh, CREDIT_KEYS, 'transaction_date') if fresh else previous.iloc[:0]
+            transactions_df, added = insert_sorted(previous, fresh, 'transaction_date')
+            transactions = self.snapshot.transactions.extend(transactions_df, added)
+            spending = copy.copy(self.snapshot.spending)
+            spending.add(fresh)
+            if self.snapshot.anomalies.accepts(fresh):
+                anomalies = self.snapshot.anomalies.copy()
+                anomalies.add(fresh)
+        else:
+            transactions_df = merge_statements(credit, CREDIT_KEYS, 'transaction_date')
+            transactions = TransactionIndex(transactions_df, descriptions = self.descriptions)
+        if anomalies is None:
+            # A FULL RELOAD, OR NEW ROWS FROM BEFORE THE LATEST MONTH ALREADY SCORED, RE-SCORE THE WHOLE HISTORY
+            anomalies = self.detector.empty()
+            anomalies.add(transactions_df)
+
+        ledger = merge_statements(bank, BANK_KEYS, 'Posting Date')
+        balance, income = self.bank_summary(ledger, 'month')
+        return Dataset(transactions_df, ledger, balance, income, version, spending, transactions, anomalies)
+
+
+class StatementWatcher(threading.Thread):
+    # Background poller that refreshes the store every interval seconds
+    def __init__(self, store, interval = 30):
+        super().__init__(name = 'statement-watcher', daemon = True)
+        self.store = store
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.store.refresh()
+            except Exception as e:
+                print('statement watcher: refresh failed: {}'.format(e))
+
+    def stop(self):
+        self._stopped.set()
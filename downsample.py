@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+
+# Series longer than MAX_POINTS are drawn with WebGL and reduced to about one point per horizontal
+# pixel of a chart, so payload and render time depend on screen width rather than row count.
+MAX_POINTS = 2000
+TARGET_POINTS = 1500
+
+
+def lttb(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: keeps the points that carry the visual shape of the series
+    # Input -> numeric x (ascending) and y arrays; Output -> indices of the n_out points to keep
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype = float)
+    y = np.asarray(y, dtype = float)
+    keep = np.empty(n_out, dtype = np.intp)
+    keep[0], keep[-1] = 0, n - 1
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo = edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+def visible_range(relayout_data):
+    # Input -> a dcc.Graph relayoutData dict; Output -> (start, end) of a zoomed x-axis, or None
+    if not relayout_data or relayout_data.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        return relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    if 'xaxis.range' in relayout_data:
+        return tuple(relayout_data['xaxis.range'][:2])
+    return None
+
+
+def clip_to_range(x, y, x_range):
+    # KEEPING ONE POINT EITHER SIDE OF THE WINDOW SO THE LINE RUNS OFF THE EDGES INSTEAD OF STOPPING SHORT
+    values = x.to_numpy()
+    lo, hi = pd.to_datetime(x_range[0]), pd.to_datetime(x_range[1])
+    start = max(np.searchsorted(values, lo.to_datetime64(), side = 'left') - 1, 0)
+    end = min(np.searchsorted(values, hi.to_datetime64(), side = 'right') + 1, len(values))
+    return x.iloc[start:end], y.iloc[start:end]
+
+
+def line_figure(x, y, relayout_data = None, markers = True):
+    # Input -> ascending datetime x and numeric y Series, plus the graph's relayoutData when zoomed
+    x = pd.Series(x).reset_index(drop = True)
+    y = pd.Series(y).reset_index(drop = True)
+    if len(x) <= MAX_POINTS:
+        fig = px.line(x = x, y = y, markers = markers)
+    else:
+        x_range = visible_range(relayout_data)
+        if x_range is not None:
+            x, y = clip_to_range(x, y, x_range)
+        keep = lttb(x.to_numpy().astype('datetime64[ns]').astype('int64'), y.to_numpy(), TARGET_POINTS)
+        fig = go.Figure(go.Scattergl(x = x.iloc[keep], y = y.iloc[keep], mode = 'lines'))
+        if x_range is not None:
+            fig.update_xaxes(range = list(x_range))
+    # uirevision KEEPS THE USER'S ZOOM WHEN THE SERVER SENDS BACK A FINER-GRAINED FIGURE
+    fig.update_layout(uirevision = 'keep')
+    # Output -> plotly figure ready for the caller's titles and axis labels
+    return fig
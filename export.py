@@ -0,0 +1,225 @@
+import argparse
+import concurrent.futures
+import hashlib
+import html
+import inspect
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+import pandas as pd
+
+
+# Headless report export. Every chart is rendered by the dashboard's own callbacks, called directly
+# (past the figure cache) in a pool of worker processes, and written as html / json / png under --out.
+# manifest.json remembers what each file was built from: a digest of the rows or totals the view reads,
+# plus its options. Re-running after a statements change only rewrites the views whose data or options
+# changed, so adding a month of statements leaves the views of earlier years alone.
+EXPORT_VERSION = 1
+MANIFEST = 'manifest.json'
+VIEWS = ['pie', 'line', 'monthsum', 'bank', 'rolling']
+FORMATS = ['html', 'json', 'png']
+
+# Figure names of callbacks that return several, in the order they are returned
+FIGURES = {'bank_update' : ['balance_line', 'balance_bar', 'income_line', 'income_bar'],
+           'rolling_update' : ['balance', 'flow']}
+
+dashboard = None
+
+
+def load_dashboard():
+    # THE EXPORTER NEVER SERVES PAGES, SO THE STATEMENTS ARE LOADED UP FRONT AND NEVER WATCHED
+    global dashboard
+    if dashboard is None:
+        os.environ['DASHBOARD_RELOAD_SECONDS'] = '0'
+        os.environ.pop('DASHBOARD_LAZY_START', None)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import Dashboard
+        dashboard = Dashboard
+    return dashboard
+
+
+def slug(*parts):
+    # Output -> file-name-safe label for one combination of inputs, 'all' for an unset filter
+    text = '_'.join('all' if p is None else str(p) for p in parts)
+    return re.sub(r'[^A-Za-z0-9_]+', '-', text).strip('-')
+
+
+def view_tasks(views, years, months, categories, include_bank):
+    # Output -> (file stem, callback name, callback arguments) for every combination asked for
+    from balance_history import WINDOWS
+    from bucketing import GRANULARITIES
+    tasks = []
+    if 'pie' in views:
+        tasks += [('pie/' + slug(y, m), 'piechart_update', [y, m, ['bank'] if include_bank else []])
+                  for y in years for m in months]
+    if 'line' in views:
+        tasks += [('line/' + slug(y, m, c), 'linechart_update', [None, None, c, y, m, None, ''])
+                  for y in years for m in months for c in categories]
+    if 'monthsum' in views:
+        tasks += [('monthsum/' + slug(y, c), 'monthsum_update', [None, None, c, y, 'month'])
+                  for y in years for c in categories]
+    if 'bank' in views:
+        tasks += [('bank/' + g, 'bank_update', [g, None]) for g in GRANULARITIES]
+    if 'rolling' in views:
+        tasks += [('rolling/{}d'.format(w), 'rolling_update', [w]) for w in WINDOWS]
+    return tasks
+
+
+def view_data(snapshot, task):
+    # Output -> the data a view's callback reads, fetched the way the callback fetches it
+    stem, callback, args = task
+    month_number = load_dashboard().month_number
+    if callback == 'piechart_update':
+        year, month, sources = args
+        month = month_number(month)
+        totals = [snapshot.spending.by_category(year, month)]
+        if 'bank' in sources:
+            totals.append(snapshot.bank_spending.by_category(year, month))
+        return totals
+    if callback == 'linechart_update':
+        start, end, category, year, month, relayout_data, search = args
+        return [snapshot.transactions.series(start, end, category, year, month_number(month), None, search)]
+    if callback == 'monthsum_update':
+        start, end, category, year, granularity = args
+        if granularity in ('day', 'week'):
+            return [snapshot.transactions.daily_totals(start, end, category, year)]
+        return [snapshot.spending.by_month(year, category, start, end, snapshot.transactions)]
+    if callback == 'rolling_update':
+        return [snapshot.daily_balance]
+    return [snapshot.ledger[[c for c in ['account', 'Posting Date', 'Amount', 'Balance'] if c in snapshot.ledger]]]
+
+
+def data_digest(snapshot, task):
+    # Output -> sha1 of every value (and index label) the view reads
+    digest = hashlib.sha1()
+    for data in view_data(snapshot, task):
+        digest.update(pd.util.hash_pandas_object(data, index = True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def task_key(digest, task, formats, plotlyjs):
+    stem, callback, args = task
+    payload = json.dumps([EXPORT_VERSION, digest, callback, args, sorted(formats), plotlyjs], default = str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def figure_names(stem, callback):
+    return [stem] if callback not in FIGURES else ['{}_{}'.format(stem, f) for f in FIGURES[callback]]
+
+
+def outputs(stem, callback, formats):
+    # Output -> every file one task writes, relative to --out
+    return [name + '.' + fmt for name in figure_names(stem, callback) for fmt in formats]
+
+
+def render(job):
+    # Runs in a pool worker: one callback call, then every figure it returned in every format
+    out_dir, (stem, callback, args), formats, plotlyjs, version = job
+    D = load_dashboard()
+    result = inspect.unwrap(getattr(D, callback))(*args, version)
+    figures = list(result) if callback in FIGURES else [result]
+    os.makedirs(os.path.join(out_dir, os.path.dirname(stem)), exist_ok = True)
+    for name, fig in zip(figure_names(stem, callback), figures):
+        path = os.path.join(out_dir, name)
+        if 'html' in formats:
+            fig.write_html(path + '.html', include_plotlyjs = plotlyjs)
+        if 'json' in formats:
+            fig.write_json(path + '.json')
+        if 'png' in formats:
+            fig.write_image(path + '.png')
+    return stem
+
+
+def write_index(out_dir, manifest):
+    # ONE PAGE LINKING EVERY EXPORTED FILE, GROUPED BY VIEW
+    rows = []
+    for stem in sorted(manifest['views']):
+        links = ' '.join('<a href="{0}">{1}</a>'.format(html.escape(f), html.escape(os.path.basename(f)))
+                         for f in manifest['views'][stem]['files'])
+        rows.append('<li>{}: {}</li>'.format(html.escape(stem), links))
+    with open(os.path.join(out_dir, 'index.html'), 'w') as f:
+        f.write('<html><body style="font-family: monospace"><h1>Finance report ({})</h1><ul>\n{}\n</ul></body></html>\n'
+                .format(html.escape(manifest['version']), '\n'.join(rows)))
+
+
+def pool_context():
+    # FORKED WORKERS INHERIT THE PARSED STATEMENTS COPY-ON-WRITE; ELSEWHERE EACH WORKER LOADS THEM ITSELF
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Render every dashboard view to static files without running the server.')
+    parser.add_argument('--out', default = 'reports', help = 'directory the files, index.html and manifest.json are written to')
+    parser.add_argument('--views', nargs = '+', choices = VIEWS, default = VIEWS)
+    parser.add_argument('--formats', nargs = '+', choices = FORMATS, default = ['html'])
+    parser.add_argument('--years', nargs = '+', type = int, help = 'default: every year, plus all years together')
+    parser.add_argument('--months', nargs = '+', help = 'month names; default: every month, plus all months together')
+    parser.add_argument('--categories', nargs = '+', help = 'default: every category, plus all categories together')
+    parser.add_argument('--include-bank', action = 'store_true', help = 'add bank account spending to the pie charts')
+    parser.add_argument('--plotlyjs', choices = ['inline', 'cdn', 'directory'], default = 'inline',
+                        help = 'inline makes every html file self-contained; cdn and directory keep them small')
+    parser.add_argument('--workers', type = int, default = os.cpu_count() or 1)
+    parser.add_argument('--force', action = 'store_true', help = 'rewrite every view, even unchanged ones')
+    args = parser.parse_args()
+
+    if 'png' in args.formats:
+        try:
+            import kaleido
+        except ImportError:
+            parser.error('png export needs kaleido (pip install kaleido)')
+
+    started = time.perf_counter()
+    D = load_dashboard()
+    snapshot = D.store.snapshot
+    if args.months and any(m not in D.months for m in args.months):
+        parser.error('months must be among: {}'.format(', '.join(D.months)))
+    years = args.years or [None] + list(snapshot.years)
+    months = args.months or [None] + D.months
+    categories = args.categories or [None] + list(snapshot.categories)
+    plotlyjs = True if args.plotlyjs == 'inline' else args.plotlyjs
+    tasks = view_tasks(args.views, years, months, categories, args.include_bank)
+
+    os.makedirs(args.out, exist_ok = True)
+    manifest_path = os.path.join(args.out, MANIFEST)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {'views' : {}}
+    manifest['version'] = snapshot.version
+
+    # A VIEW IS SKIPPED WHEN ITS DATA, INPUTS AND OUTPUT OPTIONS MATCH THE LAST EXPORT AND ITS FILES EXIST
+    pending = []
+    for task in tasks:
+        stem, callback, call_args = task
+        key = task_key(data_digest(snapshot, task), task, args.formats, args.plotlyjs)
+        files = outputs(stem, callback, args.formats)
+        previous = manifest['views'].get(stem)
+        if (not args.force and previous is not None and previous['key'] == key
+                and all(os.path.exists(os.path.join(args.out, f)) for f in files)):
+            continue
+        pending.append((task, key, files))
+
+    jobs = [(args.out, task, args.formats, plotlyjs, snapshot.version) for task, key, files in pending]
+    workers = max(1, min(args.workers, len(jobs)))
+    if workers == 1:
+        done = [render(job) for job in jobs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context = pool_context()) as pool:
+            done = list(pool.map(render, jobs, chunksize = max(1, len(jobs) // (workers * 4))))
+
+    # VIEWS THAT ARE NO LONGER REQUESTED KEEP THEIR ENTRIES (AND FILES) FROM EARLIER EXPORTS
+    for (task, key, files), stem in zip(pending, done):
+        manifest['views'][stem] = {'key' : key, 'files' : files}
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent = 1)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    write_index(args.out, manifest)
+
+    print('exported {} of {} views ({} unchanged) to {} in {:.1f}s with {} worker(s)'.format(
+        len(pending), len(tasks), len(tasks) - len(pending), args.out, time.perf_counter() - started, workers))
@@ -0,0 +1,160 @@
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+
+def _freeze(value):
+    # LISTS AND DICTS (e.g. DataTable sort_by) BECOME HASHABLE TUPLES SO THEY CAN FORM PART OF A KEY
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+# Callback arguments left out of keys. A callback's version input only makes it fire again after a reload:
+# the page may send a stale one (or None, from a layout built before the data), while every key already
+# carries the version the cache was set to, so keying on it would stop warmed entries from ever being hit
+UNKEYED = ('version',)
+
+
+class CallbackCache:
+    # LRU memo for callback results (figures, record lists), bounded by entry count and optionally by
+    # pickled size. An optional disk tier in disk_dir is shared by every worker pointing at it.
+    # Keys include the dataset version, and set_version() drops everything built from older data.
+    def __init__(self, max_entries = 256, max_bytes = None, disk_dir = None, disk_max_entries = 4096):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._building = {}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok = True)
+
+    def set_version(self, version):
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self._entries.clear()
+                self._bytes = 0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha1(repr(key).encode()).hexdigest() + '.pkl')
+
+    def get(self, key):
+        # Output -> (True, value) on a hit, (False, None) on a miss
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key][0]
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                with open(path, 'rb') as f:
+                    blob = f.read()
+                value = pickle.loads(blob)
+                os.utime(path)
+            except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+                pass
+            else:
+                self._remember(key, value, len(blob))
+                with self._lock:
+                    self.hits += 1
+                return True, value
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def put(self, key, value):
+        blob = None
+        if self.max_bytes is not None or self.disk_dir:
+            try:
+                blob = pickle.dumps(value, protocol = pickle.HIGHEST_PROTOCOL)
+            except (pickle.PicklingError, AttributeError, TypeError):
+                blob = None
+        self._remember(key, value, len(blob) if blob is not None else 0)
+        if self.disk_dir and blob is not None:
+            self._write_disk(key, blob)
+
+    def _remember(self, key, value, size):
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            if key[0] != self.version:
+                return
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            # EVICTING LEAST RECENTLY USED ENTRIES UNTIL BOTH LIMITS HOLD AGAIN
+            while len(self._entries) > self.max_entries or (self.max_bytes is not None and self._bytes > self.max_bytes):
+                self._bytes -= self._entries.popitem(last = False)[1][1]
+
+    def _write_disk(self, key, blob):
+        path = self._disk_path(key)
+        tmp = path + '.tmp{}'.format(os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(blob)
+            os.replace(tmp, path)
+            files = [os.path.join(self.disk_dir, name) for name in os.listdir(self.disk_dir) if name.endswith('.pkl')]
+            if len(files) > self.disk_max_entries:
+                files.sort(key = os.path.getmtime)
+                for old in files[:len(files) - self.disk_max_entries]:
+                    os.remove(old)
+        except OSError:
+            pass
+
+    def memoize(self, func):
+        # Wraps a callback so identical (normalized) inputs against the same dataset version are served from cache
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (self.version, func.__name__, _freeze(tuple(v for k, v in bound.arguments.items() if k not in UNKEYED)))
+            hit, value = self.get(key)
+            if hit:
+                return value
+
+            # CONCURRENT MISSES ON ONE KEY (A WARM-UP AND A PAGE LOAD, OR SEVERAL TABS) WAIT FOR A SINGLE BUILD
+            with self._lock:
+                building = self._building.get(key)
+                if building is None:
+                    self._building[key] = threading.Event()
+            if building is not None:
+                building.wait()
+                hit, value = self.get(key)
+                if hit:
+                    return value
+                return func(*args, **kwargs)
+            try:
+                value = func(*args, **kwargs)
+                self.put(key, value)
+                return value
+            finally:
+                with self._lock:
+                    self._building.pop(key).set()
+
+        return wrapper
+
+    def stats(self):
+        with self._lock:
+            return {'entries' : len(self._entries), 'bytes' : self._bytes, 'hits' : self.hits, 'misses' : self.misses}
@@ -0,0 +1,194 @@
+import collections
+import functools
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context, request
+
+
+# Upper bounds (seconds) of the latency histogram buckets exported on /metrics
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+
+
+class Metrics:
+    # Process-wide latency histograms, row counters and payload sizes, rendered in Prometheus text format
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}
+        self.rows = collections.Counter()
+        self.payload = {}
+        self.gauges = {}
+
+    def observe(self, name, stage, seconds):
+        with self._lock:
+            entry = self.latency.setdefault((name, stage), {'count' : 0, 'sum' : 0.0, 'buckets' : [0] * len(BUCKETS)})
+            entry['count'] += 1
+            entry['sum'] += seconds
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    entry['buckets'][i] += 1
+
+    def add_rows(self, name, rows):
+        with self._lock:
+            self.rows[name] += rows
+
+    def add_payload(self, name, size):
+        with self._lock:
+            entry = self.payload.setdefault(name, [0, 0])
+            entry[0] += 1
+            entry[1] += size
+
+    def render(self):
+        lines = ['# HELP dashboard_stage_seconds Time spent per callback / ingestion function and stage.',
+                 '# TYPE dashboard_stage_seconds histogram']
+        with self._lock:
+            for (name, stage), entry in sorted(self.latency.items()):
+                labels = 'function="{}",stage="{}"'.format(name, stage)
+                for bound, count in zip(BUCKETS, entry['buckets']):
+                    lines.append('dashboard_stage_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, count))
+                lines.append('dashboard_stage_seconds_bucket{{{},le="+Inf"}} {}'.format(labels, entry['count']))
+                lines.append('dashboard_stage_seconds_sum{{{}}} {:.6f}'.format(labels, entry['sum']))
+                lines.append('dashboard_stage_seconds_count{{{}}} {}'.format(labels, entry['count']))
+            lines += ['# HELP dashboard_rows_total Rows processed per callback / ingestion function.',
+                      '# TYPE dashboard_rows_total counter']
+            for name, rows in sorted(self.rows.items()):
+                lines.append('dashboard_rows_total{{function="{}"}} {}'.format(name, rows))
+            lines += ['# HELP dashboard_response_bytes Callback response payload size.',
+                      '# TYPE dashboard_response_bytes summary']
+            for name, (count, size) in sorted(self.payload.items()):
+                lines.append('dashboard_response_bytes_sum{{function="{}"}} {}'.format(name, size))
+                lines.append('dashboard_response_bytes_count{{function="{}"}} {}'.format(name, count))
+            gauges = dict(self.gauges)
+        for name, read in sorted(gauges.items()):
+            lines += ['# TYPE {} gauge'.format(name), '{} {}'.format(name, read())]
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def _trace():
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def stage(name):
+    # Times one step (filter, aggregate, figure, ...) of whichever instrumented function is running
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        current = getattr(_local, 'function', None)
+        if current is not None:
+            metrics.observe(current, name, elapsed)
+        trace = _trace()
+        if trace is not None:
+            trace.append((name, elapsed))
+
+
+def record_rows(rows):
+    current = getattr(_local, 'function', None)
+    if current is not None:
+        metrics.add_rows(current, int(rows))
+
+
+def instrument(func):
+    # Wraps a callback or ingestion function so its total time and inner stage() blocks are recorded
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        outer = getattr(_local, 'function', None)
+        _local.function = func.__name__
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            _local.function = outer
+            metrics.observe(func.__name__, 'total', elapsed)
+            trace = _trace()
+            if trace is not None and outer is None and has_request_context():
+                trace.append((func.__name__, elapsed))
+                g.dashboard_function = func.__name__
+
+    return wrapper
+
+
+class SamplingProfiler(threading.Thread):
+    # Samples every other thread's Python stack at a fixed interval and counts collapsed stacks
+    # (root;...;leaf), the input format of flamegraph tools
+    def __init__(self, interval = 0.005):
+        super().__init__(name = 'sampling-profiler', daemon = True)
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                names = []
+                while frame is not None:
+                    names.append('{}:{}'.format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+                    frame = frame.f_back
+                with self._lock:
+                    self.stacks[';'.join(reversed(names))] += 1
+
+    def report(self, reset = False):
+        with self._lock:
+            text = '\n'.join('{} {}'.format(stack, count) for stack, count in self.stacks.most_common())
+            if reset:
+                self.stacks.clear()
+        return text + '\n'
+
+    def stop(self):
+        self._stopped.set()
+
+
+def install(server, profile_interval = None):
+    # Input -> the Flask server behind the Dash app; a profile_interval (seconds) enables /debug/profile
+    @server.before_request
+    def _start_trace():
+        g.dashboard_started = time.perf_counter()
+        _local.trace = []
+
+    @server.after_request
+    def _server_timing(response):
+        trace = _trace()
+        _local.trace = None
+        name = g.pop('dashboard_function', None)
+        if trace is None or name is None:
+            return response
+        total = time.perf_counter() - g.dashboard_started
+        callback = sum(elapsed for step, elapsed in trace if step == name)
+        # WHATEVER THE REQUEST SPENT OUTSIDE THE CALLBACK ITSELF IS DASH'S JSON SERIALISATION AND ROUTING
+        metrics.observe(name, 'serialize', max(total - callback, 0.0))
+        metrics.add_payload(name, response.content_length or 0)
+        steps = ['{};dur={:.2f}'.format(step.replace(' ', '_'), elapsed * 1000) for step, elapsed in trace]
+        steps.append('serialize;dur={:.2f}'.format(max(total - callback, 0.0) * 1000))
+        steps.append('total;dur={:.2f}'.format(total * 1000))
+        response.headers['Server-Timing'] = ', '.join(steps)
+        return response
+
+    @server.route('/metrics')
+    def _metrics():
+        return Response(metrics.render(), mimetype = 'text/plain; version=0.0.4')
+
+    if profile_interval:
+        profiler = SamplingProfiler(profile_interval)
+        profiler.start()
+
+        @server.route('/debug/profile')
+        def _profile():
+            return Response(profiler.report(reset = request.args.get('reset') == '1'), mimetype = 'text/plain')
+
+        return profiler
+    return None
@@ -0,0 +1,167 @@
+import csv
+import hashlib
+import re
+import threading
+from collections import deque
+
+import pandas as pd
+
+
+# Rules live in csv files with a pattern, merchant, category header. A pattern matches whole words of the
+# description, ignoring case and runs of spaces, so 'inter bus mach' matches the padded bank text
+# 'INTER BUS MACH   IBMSUPPAYS' while 'check' does not fire inside 'New Checking'. A pattern ending in '*'
+# may also end inside a word ('amzn*' matches 'AMZNMKTP'). When several patterns match, the longest wins,
+# then the earliest.
+
+# Bank categories that move money between accounts rather than spend it; they stay out of the spending pie
+NON_SPENDING = {'Credit Card Payment', 'Transfer', 'Investment', 'Income'}
+
+# Reference numbers, ACH ids and dates that make one merchant's descriptions all distinct
+_NOISE = re.compile(r'\b(?:PPD|WEB|CCD) ID:.*$|\S*\d{4,}\S*|\b\d{2}/\d{2}\b|[#*]')
+
+
+def normalize(text):
+    # Input -> raw description; Output -> lower-cased text with every run of whitespace as one space
+    return ' '.join(text.lower().split())
+
+
+def clean_description(text):
+    # Output -> the description without reference numbers, used as the merchant when no rule matches
+    cleaned = ' '.join(_NOISE.sub(' ', text).split())
+    return cleaned or ' '.join(text.split())
+
+
+class PatternMatcher:
+    # Aho-Corasick automaton over every pattern at once: one pass over a description finds all the
+    # patterns it contains, so the cost of a lookup follows the length of the text, not the rule count
+    def __init__(self, patterns):
+        # Input -> patterns already passed through normalize()
+        self.lengths = [len(p) for p in patterns]
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for i, pattern in enumerate(patterns):
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append(i)
+
+        # BREADTH-FIRST, EACH STATE'S FAILURE LINK POINTS AT ITS LONGEST PROPER SUFFIX THAT IS ALSO A PREFIX,
+        # AND IT INHERITS THAT STATE'S MATCHES
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def matches(self, text):
+        # Output -> (start offset, pattern id) of every occurrence of every pattern in text
+        state = 0
+        for end, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for i in self.output[state]:
+                yield end + 1 - self.lengths[i], i
+
+
+class MerchantCategorizer:
+    # Maps raw descriptions to a canonical (merchant, category). Every distinct description is resolved
+    # once per process and cached, and frames are resolved through their categorical codes, so a
+    # million-row ledger costs one lookup per distinct string.
+    def __init__(self, rules = None):
+        # Input -> (pattern, merchant, category) tuples in priority order
+        rules = [(normalize(p), m, c or None) for p, m, c in (rules or []) if normalize(p).rstrip('*')]
+        self.rules = [(m, c) for p, m, c in rules]
+        self.prefix = [p.endswith('*') for p, m, c in rules]
+        self.matcher = PatternMatcher([p.rstrip('*').rstrip() for p, m, c in rules])
+        digest = hashlib.sha1(repr(rules).encode()).hexdigest()
+        # Output -> fingerprint of the rule set, folded into the dataset version so cached figures follow rule edits
+        self.fingerprint = {'sha1' : digest}
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_csv(cls, *paths):
+        # Input -> rule files, highest priority first; missing files are skipped
+        rules = []
+        for path in paths:
+            try:
+                with open(path, newline = '') as f:
+                    rules += [(r['pattern'], r['merchant'], r['category']) for r in csv.DictReader(f)]
+            except FileNotFoundError:
+                continue
+        return cls(rules)
+
+    def resolve(self, description):
+        # Output -> (merchant, category or None) for one raw description
+        if not isinstance(description, str):
+            return None, None
+        with self._lock:
+            if description in self._cache:
+                return self._cache[description]
+        text = normalize(description)
+        best = None
+        for start, i in self.matcher.matches(text):
+            # A RULE ONLY COUNTS WHERE A WORD BEGINS, SO 'gas' DOES NOT FIRE INSIDE 'las vegas', AND (UNLESS
+            # IT ENDS IN '*') WHERE ONE ENDS, SO 'bart' DOES NOT FIRE ON 'bartender'
+            end = start + self.matcher.lengths[i]
+            if start and text[start - 1].isalnum():
+                continue
+            if not self.prefix[i] and end < len(text) and text[end].isalnum():
+                continue
+            if best is None or (-self.matcher.lengths[i], i) < (-self.matcher.lengths[best], best):
+                best = i
+        result = self.rules[best] if best is not None else (clean_description(description), None)
+        with self._lock:
+            self._cache[description] = result
+        return result
+
+    def _resolve_column(self, column):
+        # ONE resolve() PER CATEGORY OF THE COLUMN, THEN BROADCAST THROUGH THE CODES
+        column = column.astype('category')
+        resolved = [self.resolve(text) for text in column.cat.categories]
+        codes = column.cat.codes.to_numpy()
+        merchants = pd.Series([m for m, c in resolved] + [None], dtype = object).to_numpy()[codes]
+        categories = pd.Series([c for m, c in resolved] + [None], dtype = object).to_numpy()[codes]
+        return (pd.Series(merchants, index = column.index).astype('category'),
+                pd.Series(categories, index = column.index).astype('category'))
+
+    def fill_categories(self, df, description_col = 'description', category_col = 'category'):
+        # Input -> card transactions; Output -> a copy whose missing categories are taken from the rules
+        missing = df[category_col].isna()
+        if not missing.any():
+            return df
+        df = df.copy()
+        filled = df[category_col].astype(object)
+        filled[missing] = self._resolve_column(df.loc[missing, description_col])[1].astype(object)
+        df[category_col] = filled.astype('category')
+        return df
+
+    def tag(self, ledger, description_col = 'Description'):
+        # Input -> bank ledger rows; Output -> a copy with Merchant and Category columns
+        ledger = ledger.copy()
+        ledger['Merchant'], ledger['Category'] = self._resolve_column(ledger[description_col])
+        return ledger
+
+
+def bank_spending_rows(ledger):
+    # Output -> the ledger's debits outside NON_SPENDING, in the transaction schema a SpendingCube groups
+    debits = ledger[ledger['Amount'] < 0]
+    category = debits['Category'].astype(object) if 'Category' in debits else pd.Series(None, index = debits.index, dtype = object)
+    spending = ~category.isin(NON_SPENDING)
+    debits, category = debits[spending], category[spending].fillna('Uncategorized')
+    return pd.DataFrame({'transaction_year' : debits['Posting Date'].dt.year.astype('int16'),
+                         'transaction_month' : debits['Posting Date'].dt.month.astype('int8'),
+                         'category' : category.astype('category'),
+                         'amount_cents' : (debits['Amount'] * -100).round().astype('int64')})
@@ -0,0 +1,242 @@
+import numpy as np
+import pandas as pd
+
+from search_index import DescriptionIndex
+
+
+EMPTY = np.empty(0, dtype = np.intp)
+# The position dicts every index keeps, and the columns each one groups the rows by
+GROUPS = [('by_category', ['category']),
+          ('by_year', ['transaction_year']),
+          ('by_month', ['transaction_month']),
+          ('by_year_month', ['transaction_year', 'transaction_month']),
+          ('by_description', ['description'])]
+
+
+def _positions(df, columns):
+    key = columns[0] if len(columns) == 1 else columns
+    groups = df.groupby(key, sort = False, observed = True).indices
+    return {k : np.asarray(v, dtype = np.intp) for k, v in groups.items()}
+
+
+class TransactionIndex:
+    # Built once per dataset: rows are presorted by transaction_date so date ranges resolve by binary
+    # search, and every dropdown value maps to the sorted row positions that carry it. Free-text search
+    # goes through a DescriptionIndex, which may be shared with (and grown by) earlier snapshots.
+    def __init__(self, df, groups = None, descriptions = None):
+        # Input -> transaction rows, plus optionally the by_* position dicts of an index already built over them
+        if df['transaction_date'].is_monotonic_increasing and df.index.equals(pd.RangeIndex(len(df))):
+            # ALREADY IN ORDER (EVERY Dataset IS), SO A READ-ONLY MAPPED FRAME IS USED AS-IS INSTEAD OF COPIED
+            self.df = df
+        else:
+            self.df = df.sort_values('transaction_date', kind = 'mergesort').reset_index(drop = True)
+        self.dates = self.df['transaction_date'].to_numpy()
+        groups = groups or {}
+        for name, columns in GROUPS:
+            setattr(self, name, groups.get(name) or _positions(self.df, columns))
+        self.descriptions = descriptions if descriptions is not None else DescriptionIndex()
+        self.descriptions.add(self.by_description)
+
+    def extend(self, df, added):
+        # Input -> this index's rows with new rows inserted, still in date order, at positions added
+        # Output -> an index over df that groups only the new rows; the existing position arrays are reused
+        #           as they are when every new row lands after them, and shifted past the new rows otherwise
+        moved = None
+        if len(added) and added[0] < len(self.df):
+            keep = np.ones(len(df), dtype = bool)
+            keep[added] = False
+            moved = np.flatnonzero(keep)
+        fresh = df.take(added)
+        groups = {}
+        for name, columns in GROUPS:
+            old = getattr(self, name)
+            merged = dict(old) if moved is None else {k : moved[v] for k, v in old.items()}
+            for k, v in _positions(fresh, columns).items():
+                v = added[v]
+                merged[k] = np.sort(np.concatenate([merged[k], v]), kind = 'stable') if k in merged else v
+            groups[name] = merged
+        return TransactionIndex(df, groups, self.descriptions)
+
+    def __len__(self):
+        return len(self.df)
+
+    def date_bounds(self, start = None, end = None):
+        # Input -> optional start / end dates (inclusive) in any format pd.to_datetime accepts
+        lo, hi = 0, len(self.dates)
+        if start is not None:
+            lo = np.searchsorted(self.dates, pd.to_datetime(start).to_datetime64(), side = 'left')
+        if end is not None:
+            hi = np.searchsorted(self.dates, pd.to_datetime(end).to_datetime64(), side = 'right')
+        return lo, max(lo, hi)
+
+    def matching(self, search):
+        # Output -> ascending positions of rows whose description matches the search box text
+        found = [self.by_description[d] for d in self.descriptions.search(search) if d in self.by_description]
+        return np.sort(np.concatenate(found)) if found else EMPTY
+
+    def positions(self, start = None, end = None, category = None, year = None, month = None, search = None):
+        # Input -> the dashboard filters, month as a number 1-12; None (or a blank search) means "no filter"
+        lo, hi = self.date_bounds(start, end)
+
+        candidates = []
+        if search and search.strip():
+            candidates.append(self.matching(search))
+        if category is not None:
+            candidates.append(self.by_category.get(category, EMPTY))
+        if year is not None and month is not None:
+            candidates.append(self.by_year_month.get((year, month), EMPTY))
+        elif year is not None:
+            candidates.append(self.by_year.get(year, EMPTY))
+        elif month is not None:
+            candidates.append(self.by_month.get(month, EMPTY))
+
+        if not candidates:
+            return np.arange(lo, hi, dtype = np.intp)
+
+        # INTERSECTING SMALLEST FIRST KEEPS EVERY STEP NO LARGER THAN THE MOST SELECTIVE FILTER
+        candidates.sort(key = len)
+        pos = candidates[0]
+        for other in candidates[1:]:
+            pos = np.intersect1d(pos, other, assume_unique = True)
+
+        # Output -> ascending row positions (so still in date order) that pass every filter
+        return pos[np.searchsorted(pos, lo):np.searchsorted(pos, hi)]
+
+    def query(self, start = None, end = None, category = None, year = None, month = None, columns = None, search = None):
+        df = self.df if columns is None else self.df[columns]
+        return df.take(self.positions(start, end, category, year, month, search))
+
+    def merchant_chunks(self, merchant_of, columns = None, chunk_rows = None):
+        # THE ROWS ARE ALREADY IN MEMORY, SO ONE CHUNK HOLDS EVERY MERCHANT (SEE SqliteTransactions.merchant_chunks)
+        yield self.query(columns = columns)
+
+    def years(self):
+        return sorted(int(year) for year in self.by_year)
+
+    def categories(self):
+        # Output -> category names in order of first appearance, as the dropdown lists them
+        return pd.unique(self.df['category'].dropna()).tolist()
+
+    def daily_totals(self, start = None, end = None, category = None, year = None):
+        # Output -> summed cents per transaction_date, in date order
+        rows = self.query(start, end, category, year, columns = ['transaction_date', 'amount_cents'])
+        return rows.groupby('transaction_date', sort = True)['amount_cents'].sum().reset_index()
+
+    def series(self, start = None, end = None, category = None, year = None, month = None, x_range = None, search = None):
+        # Output -> every (transaction_date, amount_cents) row of the filter; the line chart downsamples in memory
+        return self.query(start, end, category, year, month, ['transaction_date', 'amount_cents'], search)
+
+    def page(self, start, end, category, year, month, filter_query, sort_by, page_current, page_size, columns, scales = None, search = None):
+        # Input -> the dashboard filters plus the DataTable's filter_query / sort_by / paging and its column map
+        df = apply_filter_query(self.query(start, end, category, year, month, search = search), filter_query, columns, scales)
+        page, page_count = page_rows(sort_rows(df, sort_by, columns), page_current, page_size)
+        # Output -> (rows of the requested page, page count, rows matching every filter)
+        return page, page_count, len(df)
+
+
+# DATATABLE filter_query SUPPORT
+FILTER_OPERATORS = [['ge', '>='],
+                    ['le', '<='],
+                    ['lt', '<'],
+                    ['gt', '>'],
+                    ['ne', '!='],
+                    ['eq', '='],
+                    ['contains'],
+                    ['datestartswith']]
+
+
+def split_filter_part(filter_part):
+    # Input -> one '&&'-separated clause of a DataTable filter_query, e.g. '{Amount ($)} > 50'
+    close = filter_part.find('}')
+    name = filter_part[filter_part.find('{') + 1 : close]
+    rest = filter_part[close + 1:].strip()
+    # 's' / 'i' prefixes only toggle case sensitivity (e.g. 'icontains'); matching is always case-insensitive
+    if rest[:1] in ('s', 'i') and not rest.startswith('contains'):
+        rest = rest[1:]
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if rest.startswith(operator):
+                value_part = rest[len(operator):].strip()
+                v0 = value_part[:1]
+                if v0 and v0 == value_part[-1] and v0 in ("'", '"', '`'):
+                    value = value_part[1:-1].replace('\\' + v0, v0)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+                # Output -> (column id, normalised operator, value)
+                return name, operator_type[0], value
+    return None, None, None
+
+
+def scaled_value(value, scale = 1):
+    # Output -> a displayed number in stored units; 4.69 * 100 is 468.99999999999994 in floating point,
+    # so the product is rounded well below a stored unit and {Amount ($)} = 4.69 still matches 469 cents
+    return round(float(value) * scale, 6)
+
+
+def apply_filter_query(df, filter_query, columns, scales = None):
+    # Input -> rows, the DataTable filter_query, a map of table column id -> df column, and for columns
+    # stored in smaller units (e.g. cents) the factor from the displayed value to the stored one
+    scales = scales or {}
+    if not filter_query:
+        return df
+    mask = np.ones(len(df), dtype = bool)
+    for part in filter_query.split(' && '):
+        name, operator, value = split_filter_part(part)
+        if name not in columns:
+            continue
+        col = df[columns[name]]
+        if pd.api.types.is_datetime64_any_dtype(col):
+            if operator == 'datestartswith' or operator == 'contains':
+                mask &= col.dt.strftime('%Y-%m-%d').str.startswith(str(value)).to_numpy()
+                continue
+            try:
+                value = pd.to_datetime(str(value))
+            except (ValueError, TypeError):
+                continue
+        elif pd.api.types.is_numeric_dtype(col) and operator not in ('contains', 'datestartswith'):
+            try:
+                value = scaled_value(value, scales.get(name, 1))
+            except (ValueError, TypeError):
+                continue
+        elif name in scales and operator == 'contains':
+            # TEXT SEARCH MATCHES THE DISPLAYED DOLLARS ('4.69'), NOT THE STORED CENTS ('469')
+            col = col / scales[name]
+        if operator == 'eq':
+            mask &= (col == value).to_numpy()
+        elif operator == 'ne':
+            mask &= (col != value).to_numpy()
+        elif operator == 'lt':
+            mask &= (col < value).to_numpy()
+        elif operator == 'le':
+            mask &= (col <= value).to_numpy()
+        elif operator == 'gt':
+            mask &= (col > value).to_numpy()
+        elif operator == 'ge':
+            mask &= (col >= value).to_numpy()
+        elif operator == 'contains':
+            mask &= col.astype(str).str.contains(str(value), case = False, regex = False).to_numpy()
+        elif operator == 'datestartswith':
+            mask &= col.astype(str).str.startswith(str(value)).to_numpy()
+    return df[mask]
+
+
+def sort_rows(df, sort_by, columns):
+    # Input -> DataTable sort_by, e.g. [{'column_id': 'Amount ($)', 'direction': 'desc'}]
+    sort_by = [s for s in (sort_by or []) if s['column_id'] in columns]
+    if not sort_by:
+        return df
+    return df.sort_values([columns[s['column_id']] for s in sort_by],
+                          ascending = [s['direction'] == 'asc' for s in sort_by],
+                          kind = 'mergesort')
+
+
+def page_rows(df, page_current, page_size):
+    # Output -> just the requested page plus the page count the DataTable needs for its pager
+    page_size = page_size or 10
+    page_count = max(1, -(-len(df) // page_size))
+    page_current = min(page_current or 0, page_count - 1)
+    start = page_current * page_size
+    return df.iloc[start : start + page_size], page_count
@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+
+from merchants import clean_description
+
+
+# A series is a run of payments to (or deposits from) one merchant at a similar amount. It is reported as
+# recurring when it has MIN_OCCURRENCES or more, at least REGULARITY of its gaps are within
+# GAP_TOLERANCE (or MIN_TOLERANCE_DAYS) of its median gap, and its amounts vary by at most MAX_AMOUNT_CV.
+MIN_OCCURRENCES = 3
+MIN_PERIOD_DAYS = 6
+GAP_TOLERANCE = 0.2
+MIN_TOLERANCE_DAYS = 3
+REGULARITY = 0.7
+MAX_AMOUNT_CV = 0.35
+# Sorted by amount, a merchant's payments start a new series wherever one is this many times the last
+AMOUNT_GAP = 1.3
+
+# Named cadences and their length in days; a median gap within GAP_TOLERANCE of one takes its name
+CADENCES = [('weekly', 7), ('biweekly', 14), ('semimonthly', 15.2), ('monthly', 30.4), ('quarterly', 91.3), ('yearly', 365.2)]
+
+COLUMNS = ['merchant', 'source', 'direction', 'cadence', 'period_days', 'occurrences', 'typical_cents', 'amount_cv',
+           'first_date', 'last_date', 'next_date', 'next_cents', 'active']
+
+
+# Every payment is keyed by one integer per (source, direction, merchant); KINDS gives each its own block of keys
+KINDS = [('Card', 'Payment'), ('Bank', 'Payment'), ('Bank', 'Deposit')]
+
+
+def _merchant_codes(descriptions, merchant_of):
+    # ONE LOOKUP PER DISTINCT DESCRIPTION; DESCRIPTIONS THAT RESOLVE TO ONE MERCHANT SHARE ITS CODE
+    descriptions = pd.Series(descriptions).astype('category')
+    merchant_codes, merchants = pd.factorize(pd.Series([merchant_of(d) for d in descriptions.cat.categories], dtype = object))
+    codes = descriptions.cat.codes.to_numpy()
+    return np.where(codes >= 0, np.r_[merchant_codes, -1][codes], -1), np.asarray(merchants, dtype = object)
+
+
+def payment_events(credit, ledger, merchant_of = None):
+    # Input -> card transactions and the bank ledger; merchant_of maps a raw description to a merchant name
+    # Output -> (events, names): one row per payment with its integer key, day number and positive amount
+    #           in cents, and the source / direction / merchant behind every key
+    merchant_of = merchant_of or clean_description
+    parts = []
+    if credit is not None and len(credit):
+        codes, merchants = _merchant_codes(credit['description'], merchant_of)
+        parts.append((0, codes, merchants, credit['transaction_date'], credit['amount_cents'].to_numpy()))
+    if ledger is not None and len(ledger):
+        cents = (ledger['Amount'].to_numpy(dtype = float) * 100).round().astype('int64')
+        if 'Merchant' in ledger:
+            merchant = ledger['Merchant'].astype('category')
+            codes, merchants = merchant.cat.codes.to_numpy(), np.asarray(merchant.cat.categories, dtype = object)
+        else:
+            codes, merchants = _merchant_codes(ledger['Description'], merchant_of)
+        parts.append((np.where(cents > 0, 2, 1), codes, merchants, ledger['Posting Date'], np.abs(cents)))
+
+    keys, days, amounts, names, offset = [], [], [], [], 0
+    for kind, codes, merchants, dates, cents in parts:
+        keys.append(np.where(codes >= 0, offset + np.asarray(kind) * len(merchants) + codes, -1))
+        days.append(dates.to_numpy().astype('datetime64[D]').astype('int64'))
+        amounts.append(cents.astype('int64'))
+        names += [(source, direction, m) for source, direction in KINDS for m in merchants]
+        offset += len(KINDS) * len(merchants)
+    events = pd.DataFrame({'key' : np.concatenate(keys) if keys else np.array([], dtype = 'int64'),
+                           'day' : np.concatenate(days) if days else np.array([], dtype = 'int64'),
+                           'amount_cents' : np.concatenate(amounts) if amounts else np.array([], dtype = 'int64')})
+    return events[(events['key'] >= 0) & (events['amount_cents'] > 0)], names
+
+
+def cadence(period_days):
+    for name, days in CADENCES:
+        if abs(period_days - days) <= days * GAP_TOLERANCE:
+            return name
+    return 'every {:.0f} days'.format(period_days)
+
+
+def _detect(events, names):
+    # Everything below is sorts, shifts and grouped reductions over integer arrays, so the cost grows with
+    # n log n in the number of payments and never compares payments pairwise
+    key, day, amount = (events[c].to_numpy() for c in ['key', 'day', 'amount_cents'])
+
+    # BOTH SORTS ARE ON ONE PACKED int64 (HIGH WORD, LOW WORD), WHICH IS SEVERAL TIMES FASTER THAN A LEXSORT
+
+    # 1. SPLIT EACH MERCHANT'S PAYMENTS INTO AMOUNT BANDS: SORTED BY AMOUNT, A BAND ENDS AT THE FIRST JUMP
+    order = np.argsort((key << 32) | amount)
+    key, day, amount = key[order], day[order], amount[order]
+    series = np.cumsum(np.r_[True, (key[1:] != key[:-1]) | (amount[1:] > amount[:-1] * AMOUNT_GAP)])
+
+    # 2. ONE EVENT PER SERIES AND DAY, THEN THE GAP IN DAYS SINCE THE SERIES' PREVIOUS EVENT
+    order = np.argsort((series << 32) | day)
+    key, day, amount, series = key[order], day[order], amount[order], series[order]
+    first = np.flatnonzero(np.r_[True, (series[1:] != series[:-1]) | (day[1:] != day[:-1])])
+    daily = pd.DataFrame({'series' : series[first], 'key' : key[first], 'day' : day[first],
+                          'amount_cents' : np.add.reduceat(amount, first)})
+    same = np.r_[False, daily['series'].to_numpy()[1:] == daily['series'].to_numpy()[:-1]]
+    daily['gap'] = np.where(same, np.r_[0, np.diff(daily['day'].to_numpy())], np.nan)
+
+    # 3. PER SERIES: HOW REGULAR THE GAPS ARE AROUND THEIR MEDIAN, AND HOW STABLE THE AMOUNTS
+    grouped = daily.groupby('series', sort = False)
+    median_gap = grouped['gap'].transform('median')
+    tolerance = np.maximum(median_gap * GAP_TOLERANCE, MIN_TOLERANCE_DAYS)
+    daily['regular'] = ((daily['gap'] - median_gap).abs() <= tolerance).where(daily['gap'].notna())
+    stats = grouped.agg(key = ('key', 'first'),
+                        occurrences = ('day', 'size'),
+                        first_day = ('day', 'first'),
+                        last_day = ('day', 'last'),
+                        period_days = ('gap', 'median'),
+                        regularity = ('regular', 'mean'),
+                        typical_cents = ('amount_cents', 'median'),
+                        amount_mean = ('amount_cents', 'mean'),
+                        amount_std = ('amount_cents', 'std'))
+    stats['amount_cv'] = (stats['amount_std'].fillna(0) / stats['amount_mean']).round(3)
+    found = stats[(stats['occurrences'] >= MIN_OCCURRENCES) & (stats['period_days'] >= MIN_PERIOD_DAYS)
+                  & (stats['regularity'] >= REGULARITY) & (stats['amount_cv'] <= MAX_AMOUNT_CV)].copy()
+
+    # 4. ONLY THE (FEW) SERIES THAT PASSED ARE LABELLED AND PROJECTED FORWARD
+    found['source'], found['direction'], found['merchant'] = zip(*[names[k] for k in found['key']]) if len(found) else ([], [], [])
+    found['first_date'] = pd.to_datetime(found['first_day'], unit = 'D')
+    found['last_date'] = pd.to_datetime(found['last_day'], unit = 'D')
+    found['cadence'] = [cadence(p) for p in found['period_days']]
+    found['next_date'] = [last + (pd.DateOffset(months = 1) if c == 'monthly' else pd.Timedelta(days = round(p)))
+                          for last, c, p in zip(found['last_date'], found['cadence'], found['period_days'])]
+    found['typical_cents'] = found['typical_cents'].round().astype('int64')
+    # THE NEXT AMOUNT FOLLOWS THE LATEST ONES, SO A PRICE CHANGE SHOWS UP AFTER A COUPLE OF PAYMENTS
+    recent = daily[daily['series'].isin(found.index)].groupby('series', sort = False).tail(3)
+    found['next_cents'] = recent.groupby('series')['amount_cents'].median().round().astype('int64')
+    return found[COLUMNS[:-1]]
+
+
+def _sources(chunks, ledger):
+    # CARD CHUNKS ONE AT A TIME, THEN THE BANK LEDGER, SO ONLY ONE CHUNK'S PAYMENTS ARE EVER HELD
+    for chunk in chunks:
+        yield chunk, None
+    yield None, ledger
+
+
+def recurring_series(credit, ledger, merchant_of = None):
+    # Input -> card transactions, as one frame or as frames that each hold every row of the merchants in
+    #          them (what transactions.merchant_chunks yields), the bank ledger, and merchant_of
+    chunks = [credit] if credit is None or isinstance(credit, pd.DataFrame) else credit
+    parts, latest = [], None
+    for card, bank in _sources(chunks, ledger):
+        events, names = payment_events(card, bank, merchant_of)
+        if len(events) == 0:
+            continue
+        latest = max(latest or 0, int(events['day'].max()))
+        found = _detect(events, names)
+        if len(found):
+            parts.append(found)
+    if not parts:
+        return pd.DataFrame(columns = COLUMNS)
+    found = pd.concat(parts, ignore_index = True)
+    # A SERIES IS STILL ACTIVE WHILE THE LATEST DATA IS NOT PAST ITS NEXT EXPECTED PAYMENT BY MORE THAN A PERIOD
+    latest = pd.to_datetime(latest, unit = 'D')
+    found['active'] = found['next_date'] + pd.to_timedelta(found['period_days'], unit = 'D') >= latest
+
+    # Output -> one row per recurring series, soonest expected payment first
+    return found.sort_values(['active', 'next_date'], ascending = [False, True], kind = 'mergesort')[COLUMNS].reset_index(drop = True)
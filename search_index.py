@@ -0,0 +1,62 @@
+import threading
+
+
+# Descriptions repeat heavily (one merchant, thousands of rows), so grams are indexed per distinct
+# description string rather than per row; TransactionIndex.by_description turns matches into rows.
+# Every gram of up to GRAM characters is indexed, so terms that short are answered by one lookup.
+GRAM = 3
+
+
+def grams(text, n):
+    return {text[i : i + n] for i in range(len(text) - n + 1)}
+
+
+class DescriptionIndex:
+    # Inverted index from lower-cased 1- to 3-character grams to the ids of the descriptions containing
+    # them. It only ever grows: add() indexes strings it has not seen, so a reload costs time in
+    # proportion to the new merchants, and a snapshot that lacks a description simply has no rows for it.
+    def __init__(self):
+        self.descriptions = []
+        self.lowered = []
+        self.ids = {}
+        self.postings = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.descriptions)
+
+    def add(self, descriptions):
+        # Input -> any iterable of description strings (non-strings such as NaN are ignored)
+        with self._lock:
+            for text in descriptions:
+                if not isinstance(text, str) or text in self.ids:
+                    continue
+                i = len(self.descriptions)
+                lowered = text.lower()
+                self.ids[text] = i
+                self.descriptions.append(text)
+                self.lowered.append(lowered)
+                for n in range(1, GRAM + 1):
+                    for gram in grams(lowered, n):
+                        self.postings.setdefault(gram, set()).add(i)
+
+    def _term(self, term):
+        if len(term) <= GRAM:
+            return self.postings.get(term, set())
+        # LONGER TERMS: INTERSECT THE POSTINGS OF EVERY TRIGRAM, SMALLEST FIRST, THEN CONFIRM THE SUBSTRING
+        # (THE TRIGRAMS CAN ALL OCCUR IN A DESCRIPTION WITHOUT BEING ADJACENT)
+        sets = sorted((self.postings.get(gram, set()) for gram in grams(term, GRAM)), key = len)
+        candidates = sets[0].intersection(*sets[1:])
+        return {i for i in candidates if term in self.lowered[i]}
+
+    def search(self, query):
+        # Input -> free text; every whitespace-separated term must occur somewhere in a description,
+        # ignoring case, so a merchant prefix ('chick-f') and a fragment ('*nike') both match
+        terms = (query or '').lower().split()
+        if not terms:
+            return None
+        with self._lock:
+            matches = sorted((self._term(term) for term in terms), key = len)
+            ids = matches[0].intersection(*matches[1:])
+            # Output -> the matching description strings (None when the query is blank)
+            return [self.descriptions[i] for i in ids]
@@ -0,0 +1,43 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+
+
+# Production launcher. This process parses the statements once, publishes them as a memory-mapped
+# Arrow dataset and keeps republishing as the statements directory changes; the gunicorn workers it
+# starts map that dataset read-only, so adding workers adds neither parse time nor a copy of the data.
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Serve the dashboard from several gunicorn workers sharing one mapped dataset.')
+    parser.add_argument('--workers', type = int, default = os.cpu_count() or 1)
+    parser.add_argument('--bind', default = '127.0.0.1:4052')
+    parser.add_argument('--shared-dir', default = os.environ.get('DASHBOARD_SHARED_DIR', '.dashboard_shared'),
+                        help = 'where the mapped dataset is published; a tmpfs such as /dev/shm keeps it off disk')
+    parser.add_argument('gunicorn_args', nargs = argparse.REMAINDER, help = 'extra gunicorn options, after --')
+    args = parser.parse_args()
+
+    shared_dir = os.path.abspath(args.shared_dir)
+    worker_env = dict(os.environ, DASHBOARD_SHARED_DIR = shared_dir)
+
+    # THIS PROCESS IS THE PUBLISHER AND NEVER SERVES A PAGE, SO IT PARSES THE STATEMENTS ITSELF, UP FRONT
+    os.environ.pop('DASHBOARD_SHARED_DIR', None)
+    os.environ.pop('DASHBOARD_LAZY_START', None)
+    import Dashboard
+    from shared_dataset import publish
+
+    publish(Dashboard.store.snapshot, shared_dir)
+    Dashboard.store.listeners.append(lambda snapshot: publish(snapshot, shared_dir))
+    print('published dataset {} to {}'.format(Dashboard.store.snapshot.version, shared_dir))
+
+    extra = [a for a in args.gunicorn_args if a != '--']
+    command = [sys.executable, '-m', 'gunicorn', '--workers', str(args.workers), '--bind', args.bind] + extra + ['Dashboard:server']
+    workers = subprocess.Popen(command, env = worker_env)
+
+    # STOPPING THE LAUNCHER STOPS GUNICORN, WHICH SHUTS ITS WORKERS DOWN GRACEFULLY
+    signal.signal(signal.SIGTERM, lambda signum, frame: workers.send_signal(signum))
+    try:
+        sys.exit(workers.wait())
+    except KeyboardInterrupt:
+        workers.send_signal(signal.SIGINT)
+        sys.exit(workers.wait())
@@ -0,0 +1,187 @@
+import json
+import os
+import pickle
+import shutil
+import threading
+
+import numpy as np
+
+from dataset import Dataset
+from query_engine import TransactionIndex
+from search_index import DescriptionIndex
+from spending_cube import SpendingCube
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+
+# A published snapshot is one directory per dataset version holding uncompressed Arrow IPC files; the
+# CURRENT file names the version serving workers should map. Older versions are kept briefly so a
+# worker that read CURRENT just before a swap can still open what it points at.
+CURRENT = 'CURRENT'
+FRAMES = ['transactions_df', 'ledger', 'balance', 'income']
+GROUPINGS = ['by_category', 'by_year', 'by_month', 'by_year_month', 'by_description']
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('the shared dataset needs pyarrow (pip install pyarrow)')
+
+
+def _write_table(table, path):
+    # THE IPC FILE FORMAT WITHOUT COMPRESSION LAYS EACH COLUMN OUT AS A PLAIN BUFFER THAT READERS CAN MAP
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def _map_table(path):
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def _map_frame(path):
+    # split_blocks STOPS pandas CONSOLIDATING SAME-DTYPE COLUMNS INTO NEW ARRAYS, SO NUMERIC, DATE AND
+    # CATEGORY-CODE COLUMNS STAY READ-ONLY VIEWS OF THE MAPPED FILE
+    return _map_table(path).to_pandas(split_blocks = True)
+
+
+def _plain(key):
+    # JSON-FRIENDLY FORM OF A TransactionIndex GROUP KEY (NUMPY SCALARS AND (YEAR, MONTH) TUPLES)
+    if isinstance(key, tuple):
+        return [_plain(k) for k in key]
+    return key.item() if isinstance(key, np.generic) else key
+
+
+def _write_snapshot(snapshot, directory):
+    manifest = {'version' : snapshot.version, 'rows' : len(snapshot.transactions_df), 'groups' : {}}
+    for name in FRAMES:
+        _write_table(pa.Table.from_pandas(getattr(snapshot, name)), os.path.join(directory, name + '.arrow'))
+    _write_table(pa.Table.from_pandas(snapshot.spending.table.reset_index(), preserve_index = False),
+                 os.path.join(directory, 'spending.arrow'))
+
+    # EACH GROUPING OF THE TRANSACTION INDEX IS STORED AS ONE POSITIONS ARRAY PLUS PER-KEY OFFSETS INTO IT
+    for name in GROUPINGS:
+        groups = getattr(snapshot.transactions, name)
+        keys = list(groups)
+        positions = np.concatenate([groups[k] for k in keys]).astype('int64') if keys else np.empty(0, dtype = 'int64')
+        _write_table(pa.table({'positions' : positions}), os.path.join(directory, name + '.arrow'))
+        manifest['groups'][name] = {'keys' : [_plain(k) for k in keys],
+                                    'offsets' : np.cumsum([0] + [len(groups[k]) for k in keys]).tolist()}
+
+    # THE ANOMALY STATISTICS ARE SMALL (PER CATEGORY AND MONTH), SO WORKERS SIMPLY UNPICKLE A COPY
+    with open(os.path.join(directory, 'anomalies.pickle'), 'wb') as f:
+        pickle.dump(snapshot.anomalies, f, protocol = pickle.HIGHEST_PROTOCOL)
+
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+
+def publish(snapshot, directory, keep = 2):
+    # Input -> a Dataset built by a StatementStore and the shared directory workers read from
+    _require_pyarrow()
+    if snapshot.transactions_df is None:
+        raise ValueError('only the in-memory dataset can be published; serve.py does not support DASHBOARD_SQLITE_PATH')
+    os.makedirs(directory, exist_ok = True)
+    target = os.path.join(directory, snapshot.version)
+    if not os.path.isdir(target):
+        tmp = target + '.tmp{}'.format(os.getpid())
+        shutil.rmtree(tmp, ignore_errors = True)
+        os.makedirs(tmp)
+        try:
+            _write_snapshot(snapshot, tmp)
+            os.replace(tmp, target)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors = True)
+            raise
+
+    # SWAPPING THE POINTER ATOMICALLY, SO A WORKER NEVER READS A HALF-WRITTEN VERSION NAME
+    pointer = os.path.join(directory, CURRENT)
+    with open(pointer + '.tmp{}'.format(os.getpid()), 'w') as f:
+        f.write(snapshot.version)
+    os.replace(pointer + '.tmp{}'.format(os.getpid()), pointer)
+
+    # UNLINKING A MAPPED FILE IS SAFE: WORKERS STILL ON AN OLD VERSION KEEP THEIR PAGES UNTIL THEY REMAP
+    versions = [os.path.join(directory, name) for name in os.listdir(directory)
+                if os.path.isfile(os.path.join(directory, name, 'manifest.json'))]
+    versions.sort(key = os.path.getmtime, reverse = True)
+    for stale in versions[keep:]:
+        if os.path.basename(stale) != snapshot.version:
+            shutil.rmtree(stale, ignore_errors = True)
+
+    # Output -> path of the version directory CURRENT now names
+    return target
+
+
+def current_version(directory):
+    try:
+        with open(os.path.join(directory, CURRENT)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def load_snapshot(path, descriptions = None):
+    # Input -> one published version directory (and the search index of the previous one, to grow)
+    # Output -> a Dataset whose row-level columns are mapped, not copied
+    _require_pyarrow()
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    frames = {name : _map_frame(os.path.join(path, name + '.arrow')) for name in FRAMES}
+
+    groups = {}
+    for name in GROUPINGS:
+        if name not in manifest['groups']:
+            # PUBLISHED BEFORE THIS GROUPING EXISTED; TransactionIndex BUILDS IT ITSELF
+            continue
+        positions = _map_table(os.path.join(path, name + '.arrow')).column('positions').to_numpy()
+        keys, offsets = manifest['groups'][name]['keys'], manifest['groups'][name]['offsets']
+        groups[name] = {tuple(k) if isinstance(k, list) else k : positions[offsets[i]:offsets[i + 1]]
+                        for i, k in enumerate(keys)}
+
+    spending = SpendingCube(table = _map_frame(os.path.join(path, 'spending.arrow')).set_index(['year', 'month', 'category']))
+    try:
+        with open(os.path.join(path, 'anomalies.pickle'), 'rb') as f:
+            anomalies = pickle.load(f)
+    except FileNotFoundError:
+        # PUBLISHED BEFORE ANOMALY DETECTION EXISTED; Dataset COMPUTES IT FROM THE MAPPED ROWS
+        anomalies = None
+    return Dataset(frames['transactions_df'], frames['ledger'], frames['balance'], frames['income'], manifest['version'],
+                   spending, TransactionIndex(frames['transactions_df'], groups, descriptions), anomalies)
+
+
+class SharedDataset:
+    # Read-only stand-in for StatementStore inside serving workers. It maps whatever version the publisher
+    # last named in CURRENT; refresh() (driven by the usual StatementWatcher) remaps when that changes.
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}
+        self.snapshot = None
+        self.listeners = []
+        self.ready = threading.Event()
+        self.descriptions = DescriptionIndex()
+        self._lock = threading.Lock()
+        if not self.refresh():
+            raise ValueError('no dataset has been published to {}; start the app with serve.py'.format(directory))
+
+    def refresh(self):
+        # Output -> True when a new snapshot was swapped in
+        with self._lock:
+            version = current_version(self.directory)
+            if version is None or (self.snapshot is not None and version == self.snapshot.version):
+                return False
+            try:
+                snapshot = load_snapshot(os.path.join(self.directory, version), self.descriptions)
+            except (OSError, KeyError, ValueError):
+                # PRUNED OR STILL BEING REPLACED; THE NEXT POLL PICKS UP WHATEVER CURRENT NAMES THEN
+                return False
+            self.snapshot = snapshot
+
+        try:
+            for listener in self.listeners:
+                listener(snapshot)
+        finally:
+            self.ready.set()
+        return True
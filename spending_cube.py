@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+
+def _aggregate(df):
+    # Input -> transaction rows with transaction_year / transaction_month / category / amount_cents
+    cube = (df.groupby([df['transaction_year'].astype(int).rename('year'),
+                        df['transaction_month'].astype(int).rename('month'),
+                        df['category'].astype(object).rename('category')], dropna = False)['amount_cents']
+              .agg(amount_cents = 'sum', count = 'size'))
+    # Output -> summed integer cents and row count per (year, month, category)
+    return cube
+
+
+class SpendingCube:
+    # Pre-aggregated year x month x category totals. Every query touches at most
+    # years * 12 * categories cells, independent of how many transactions were loaded.
+    def __init__(self, df = None, table = None):
+        # Input -> transaction rows to aggregate, or a table previously taken from another cube
+        self.table = table if table is not None else _aggregate(df).sort_index()
+
+    def add(self, df):
+        # Input -> newly ingested transaction rows; only those rows are grouped
+        if len(df) == 0:
+            return
+        self.table = self.table.add(_aggregate(df), fill_value = 0).sort_index()
+        self.table = self.table.astype({'amount_cents' : 'int64', 'count' : 'int64'})
+
+    def _select(self, year = None, month = None, category = None):
+        index = self.table.index
+        mask = np.ones(len(index), dtype = bool)
+        if year is not None:
+            mask &= index.get_level_values('year') == year
+        if month is not None:
+            mask &= index.get_level_values('month') == month
+        if category is not None:
+            mask &= index.get_level_values('category') == category
+        return self.table[mask]
+
+    def by_category(self, year = None, month = None):
+        # Output -> Series of summed dollars per category, for the pie chart
+        return self._select(year, month).groupby(level = 'category', sort = False)['amount_cents'].sum() / 100
+
+    def by_month(self, year = None, category = None, start = None, end = None, rows = None):
+        # Input -> dropdown filters plus an optional inclusive date range; rows is the TransactionIndex
+        # used to total the (at most two) months the range only partially covers
+        totals = self._select(year, category = category).groupby(level = ['year', 'month'])['amount_cents'].sum()
+        if start is None and end is None:
+            return totals / 100
+
+        ordinal = totals.index.get_level_values('year') * 12 + totals.index.get_level_values('month') - 1
+        keep = np.ones(len(totals), dtype = bool)
+        partial = []
+        if start is not None:
+            start = pd.to_datetime(start)
+            keep &= ordinal >= start.year * 12 + start.month - 1
+            if start.day != 1:
+                partial.append((start.year, start.month))
+        if end is not None:
+            end = pd.to_datetime(end)
+            keep &= ordinal <= end.year * 12 + end.month - 1
+            if end.day != end.days_in_month:
+                partial.append((end.year, end.month))
+        totals = totals[keep]
+
+        # REPLACING THE EDGE MONTHS WITH ROW-LEVEL SUMS OVER JUST THE DAYS INSIDE THE RANGE
+        for key in set(partial):
+            if key not in totals.index:
+                continue
+            part = rows.query(start, end, category, key[0], key[1])
+            if len(part):
+                totals.loc[key] = part['amount_cents'].sum()
+            else:
+                totals = totals.drop(key)
+
+        # Output -> Series of summed dollars indexed by (year, month), in calendar order
+        return totals / 100
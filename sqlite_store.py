@@ -0,0 +1,408 @@
+import os
+import pathlib
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+from anomalies import AnomalyDetector
+from dataset import BANK_KEYS, Dataset, StatementStore, merge_statements
+from downsample import MAX_POINTS, TARGET_POINTS
+from query_engine import scaled_value, split_filter_part
+
+
+# transaction_date is stored as integer nanoseconds, so range filters compare plain integers and rows
+# convert back to datetime64 without parsing. The identity index doubles as the deduplication key for
+# rows repeated across overlapping exports of one account, and as the date-range index.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS transactions (
+    account TEXT NOT NULL,
+    transaction_date INTEGER NOT NULL,
+    transaction_year INTEGER NOT NULL,
+    transaction_month INTEGER NOT NULL,
+    description TEXT,
+    category TEXT,
+    type TEXT,
+    amount_cents INTEGER NOT NULL,
+    occurrence INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS transactions_identity
+    ON transactions (transaction_date, account, ifnull(description, ''), ifnull(category, ''), ifnull(type, ''), amount_cents, occurrence);
+CREATE INDEX IF NOT EXISTS transactions_account ON transactions (account, transaction_date, category);
+CREATE INDEX IF NOT EXISTS transactions_category ON transactions (category, transaction_date);
+CREATE INDEX IF NOT EXISTS transactions_year_month ON transactions (transaction_year, transaction_month, category);
+CREATE INDEX IF NOT EXISTS transactions_description ON transactions (description, transaction_date);
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, sha1 TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS descriptions (description TEXT PRIMARY KEY);
+'''
+
+# Merchant search: a trigram full-text index over the distinct descriptions (needs SQLite 3.34+; without
+# it, and for terms under three characters, the distinct descriptions are scanned instead)
+SEARCH_SCHEMA = "CREATE VIRTUAL TABLE IF NOT EXISTS description_search USING fts5(description, tokenize = 'trigram')"
+
+COLUMNS = ['transaction_date', 'description', 'category', 'type', 'amount_cents', 'transaction_year', 'transaction_month']
+# Rows read per batch when streaming transactions to the anomaly detector or the recurring-charge detection
+CHUNK_ROWS = 200000
+DTYPES = {'amount_cents' : 'int64', 'transaction_year' : 'int16', 'transaction_month' : 'int8'}
+SQL_OPERATORS = {'eq' : '=', 'ne' : 'IS NOT', 'lt' : '<', 'le' : '<=', 'gt' : '>', 'ge' : '>='}
+
+
+def _where(start = None, end = None, category = None, year = None, month = None):
+    # Output -> (' WHERE ...' or '', parameters) for the dashboard filters, month as a number 1-12
+    clauses, params = [], []
+    if start is not None:
+        clauses.append('transaction_date >= ?')
+        params.append(pd.to_datetime(start).value)
+    if end is not None:
+        clauses.append('transaction_date <= ?')
+        params.append(pd.to_datetime(end).value)
+    for column, value in [('category', category), ('transaction_year', year), ('transaction_month', month)]:
+        if value is not None:
+            clauses.append('{} = ?'.format(column))
+            params.append(value)
+    return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+
+def search_clauses(search, fts = True):
+    # EVERY WHITESPACE-SEPARATED TERM MUST OCCUR IN THE DESCRIPTION, AS WITH DescriptionIndex.search
+    clauses, params = [], []
+    for term in (search or '').lower().split():
+        if fts and len(term) >= 3:
+            clauses.append('description IN (SELECT description FROM description_search WHERE description_search MATCH ?)')
+            params.append('"{}"'.format(term.replace('"', '""')))
+        else:
+            clauses.append('description IN (SELECT description FROM descriptions WHERE instr(lower(description), ?) > 0)')
+            params.append(term)
+    return clauses, params
+
+
+def filter_clauses(filter_query, columns, scales = None):
+    # SQL TRANSLATION OF query_engine.apply_filter_query, CLAUSE FOR CLAUSE
+    scales = scales or {}
+    clauses, params = [], []
+    for part in (filter_query.split(' && ') if filter_query else []):
+        name, operator, value = split_filter_part(part)
+        if name not in columns:
+            continue
+        col = columns[name]
+        if col == 'transaction_date':
+            if operator in ('datestartswith', 'contains'):
+                clauses.append("substr(date(transaction_date / 1000000000, 'unixepoch'), 1, ?) = ?")
+                params += [len(str(value)), str(value)]
+                continue
+            try:
+                value = pd.to_datetime(str(value)).value
+            except (ValueError, TypeError):
+                continue
+        elif col in DTYPES and operator not in ('contains', 'datestartswith'):
+            try:
+                value = scaled_value(value, scales.get(name, 1))
+            except (ValueError, TypeError):
+                continue
+        if operator in SQL_OPERATORS:
+            clauses.append('{} {} ?'.format(col, SQL_OPERATORS[operator]))
+            params.append(value)
+        elif operator == 'contains' and name in scales:
+            # SAME TEXT AS pandas GIVES THE DISPLAYED DOLLARS, E.G. '4.69' AND '30.0'
+            clauses.append('instr(CAST({} / ? AS TEXT), ?) > 0'.format(col))
+            params += [float(scales[name]), str(value)]
+        elif operator == 'contains':
+            clauses.append("instr(lower(ifnull(CAST({} AS TEXT), '')), lower(?)) > 0".format(col))
+            params.append(str(value))
+        elif operator == 'datestartswith':
+            clauses.append('substr(CAST({} AS TEXT), 1, ?) = ?'.format(col))
+            params += [len(str(value)), str(value)]
+    return clauses, params
+
+
+def order_clause(sort_by, columns):
+    # NULLS LAST AND DATE / INSERTION ORDER AS TIE-BREAKERS, MATCHING THE STABLE IN-MEMORY sort_rows
+    terms = []
+    for s in (sort_by or []):
+        if s['column_id'] in columns:
+            col = columns[s['column_id']]
+            terms.append('{0} IS NULL, {0} {1}'.format(col, 'ASC' if s['direction'] == 'asc' else 'DESC'))
+    return ' ORDER BY ' + ', '.join(terms + ['transaction_date', 'rowid'])
+
+
+class SqliteTransactions:
+    # TransactionIndex counterpart over the transactions table: every filter, sort, page and sum runs in
+    # SQLite against its indexes, and only the rows a callback actually returns are loaded into pandas
+    def __init__(self, path):
+        self.uri = pathlib.Path(path).absolute().as_uri() + '?mode=ro'
+        self._local = threading.local()
+        self.rows = self._execute('SELECT COUNT(*) FROM transactions')[0][0]
+        self.fts = bool(self._execute("SELECT 1 FROM sqlite_master WHERE name = 'description_search'"))
+
+    def _connection(self):
+        # ONE READ-ONLY CONNECTION PER THREAD; sqlite3 CONNECTIONS CANNOT BE SHARED BETWEEN THREADS, NOR
+        # CARRIED INTO A FORKED PROCESS (export.py's WORKERS), SO A CHILD OPENS ITS OWN
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._local.conn = sqlite3.connect(self.uri, uri = True)
+            self._local.pid = os.getpid()
+        return conn
+
+    def _execute(self, sql, params = ()):
+        return self._connection().execute(sql, params).fetchall()
+
+    def _frame(self, sql, params, columns):
+        return self._records(self._execute(sql, params), columns)
+
+    def _records(self, rows, columns):
+        df = pd.DataFrame.from_records(rows, columns = columns)
+        if 'transaction_date' in df:
+            df['transaction_date'] = pd.to_datetime(df['transaction_date'].astype('int64'))
+        return df.astype({c : t for c, t in DTYPES.items() if c in df})
+
+    def _where(self, start = None, end = None, category = None, year = None, month = None, search = None):
+        where, params = _where(start, end, category, year, month)
+        clauses, extra = search_clauses(search, self.fts)
+        if clauses:
+            where += (' AND ' if where else ' WHERE ') + ' AND '.join(clauses)
+        return where, params + extra
+
+    def __len__(self):
+        return self.rows
+
+    def query(self, start = None, end = None, category = None, year = None, month = None, columns = None, search = None):
+        columns = columns or COLUMNS
+        where, params = self._where(start, end, category, year, month, search)
+        sql = 'SELECT {} FROM transactions{} ORDER BY transaction_date, rowid'.format(', '.join(columns), where)
+        return self._frame(sql, params, columns)
+
+    def merchant_chunks(self, merchant_of, columns = None, chunk_rows = CHUNK_ROWS):
+        # Input -> a function from description to merchant name; Output -> frames of about chunk_rows rows,
+        #          each holding every row of the merchants in it, so per-merchant work never sees the whole table
+        columns = columns or COLUMNS
+        conn = self._connection()
+        # THE MERCHANT OF EACH DISTINCT DESCRIPTION GOES INTO A TEMPORARY TABLE (THE DATABASE ITSELF STAYS
+        # READ-ONLY), AND SQLite SORTS THE ROWS BY IT, SPILLING TO DISK WHEN THEY DO NOT FIT IN MEMORY.
+        # ROWS CARRY THE DESCRIPTION'S NUMBER RATHER THAN ITS TEXT, AND BECOME A CATEGORICAL COLUMN
+        descriptions = [row[0] for row in conn.execute('SELECT description FROM descriptions')]
+        merchants = pd.factorize(pd.Series([merchant_of(d) for d in descriptions], dtype = object))[0]
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS merchant_of (description TEXT PRIMARY KEY, code INTEGER NOT NULL, merchant INTEGER NOT NULL)')
+        with conn:
+            conn.execute('DELETE FROM temp.merchant_of')
+            conn.executemany('INSERT INTO temp.merchant_of VALUES (?, ?, ?)', zip(descriptions, range(len(descriptions)), merchants.tolist()))
+        selected = ['m.code' if c == 'description' else 't.' + c for c in columns]
+        cursor = conn.execute('SELECT m.merchant, {} FROM transactions t JOIN temp.merchant_of m ON m.description = t.description '
+                              'WHERE m.merchant >= 0 ORDER BY m.merchant'.format(', '.join(selected)))
+        pending = None
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            df = self._records(rows, ['merchant'] + columns)
+            if 'description' in df:
+                df['description'] = pd.Categorical.from_codes(df['description'].to_numpy(), descriptions)
+            pending = df if pending is None else pd.concat([pending, df], ignore_index = True)
+            # THE LAST MERCHANT MAY CONTINUE INTO THE NEXT FETCH, SO ITS ROWS WAIT FOR IT
+            merchant = pending['merchant'].to_numpy()
+            cut = int(np.searchsorted(merchant, merchant[-1]))
+            if cut:
+                yield pending.iloc[:cut][columns]
+                pending = pending.iloc[cut:].reset_index(drop = True)
+        if pending is not None and len(pending):
+            yield pending[columns]
+
+    def years(self):
+        return [row[0] for row in self._execute('SELECT DISTINCT transaction_year FROM transactions ORDER BY 1')]
+
+    def categories(self):
+        sql = 'SELECT category FROM transactions WHERE category IS NOT NULL GROUP BY category ORDER BY MIN(transaction_date), MIN(rowid)'
+        return [row[0] for row in self._execute(sql)]
+
+    def daily_totals(self, start = None, end = None, category = None, year = None):
+        where, params = _where(start, end, category, year)
+        sql = 'SELECT transaction_date, SUM(amount_cents) FROM transactions{} GROUP BY transaction_date ORDER BY transaction_date'.format(where)
+        return self._frame(sql, params, ['transaction_date', 'amount_cents'])
+
+    def series(self, start = None, end = None, category = None, year = None, month = None, x_range = None, search = None):
+        # Input -> the dashboard filters plus the line chart's zoomed x range (or None)
+        where, params = self._where(start, end, category, year, month, search)
+        count, lo, hi = self._execute('SELECT COUNT(*), MIN(transaction_date), MAX(transaction_date) FROM transactions' + where, params)[0]
+        if count <= MAX_POINTS:
+            return self.query(start, end, category, year, month, ['transaction_date', 'amount_cents'], search)
+        if x_range is not None:
+            lo = max(lo, pd.to_datetime(x_range[0]).value)
+            hi = min(hi, pd.to_datetime(x_range[1]).value)
+            where += (' AND ' if where else ' WHERE ') + 'transaction_date BETWEEN ? AND ?'
+            params = params + [lo, hi]
+
+        # TOO MANY ROWS TO SHIP: EACH OF TARGET_POINTS TIME BUCKETS CONTRIBUTES ITS LOWEST AND HIGHEST ROW
+        # (SQLite FILLS BARE COLUMNS FROM THE ROW THAT MIN / MAX PICKED), WHICH KEEPS EVERY SPIKE VISIBLE
+        width = max((hi - lo) // TARGET_POINTS + 1, 1)
+        sql = ('SELECT transaction_date, {0}(amount_cents) FROM transactions{1} GROUP BY (transaction_date - ?) / ?')
+        rows = (self._execute(sql.format('MIN', where), params + [lo, width])
+                + self._execute(sql.format('MAX', where), params + [lo, width]))
+        df = pd.DataFrame.from_records(sorted(set(rows)), columns = ['transaction_date', 'amount_cents'])
+        df['transaction_date'] = pd.to_datetime(df['transaction_date'].astype('int64'))
+        # Output -> (transaction_date, amount_cents) rows in date order, at most 2 * TARGET_POINTS of them
+        return df.astype({'amount_cents' : 'int64'})
+
+    def page(self, start, end, category, year, month, filter_query, sort_by, page_current, page_size, columns, scales = None, search = None):
+        # Input -> the dashboard filters plus the DataTable's filter_query / sort_by / paging and its column map
+        where, params = self._where(start, end, category, year, month, search)
+        clauses, extra = filter_clauses(filter_query, columns, scales)
+        if clauses:
+            where += (' AND ' if where else ' WHERE ') + ' AND '.join(clauses)
+            params = params + extra
+        total = self._execute('SELECT COUNT(*) FROM transactions' + where, params)[0][0]
+
+        page_size = page_size or 10
+        page_count = max(1, -(-total // page_size))
+        page_current = min(page_current or 0, page_count - 1)
+        sql = 'SELECT {} FROM transactions{}{} LIMIT ? OFFSET ?'.format(', '.join(COLUMNS), where, order_clause(sort_by, columns))
+        page = self._frame(sql, params + [page_size, page_current * page_size], COLUMNS)
+        # Output -> (rows of the requested page, page count, rows matching every filter)
+        return page, page_count, total
+
+
+class SqliteSpending:
+    # SpendingCube counterpart: the same totals, grouped by SQLite instead of read from a pre-aggregated table
+    def __init__(self, transactions):
+        self.transactions = transactions
+
+    def by_category(self, year = None, month = None):
+        where, params = _where(year = year, month = month)
+        where += (' AND ' if where else ' WHERE ') + 'category IS NOT NULL'
+        # ORDERED AS THE CUBE GROUPS THEM: BY THE FIRST MONTH A CATEGORY APPEARS IN, THEN BY NAME
+        rows = self.transactions._execute('SELECT category, SUM(amount_cents) FROM transactions{} GROUP BY category '
+                                          'ORDER BY MIN(transaction_year * 12 + transaction_month), category'.format(where), params)
+        index = pd.Index([r[0] for r in rows], name = 'category')
+        # Output -> Series of summed dollars per category, for the pie chart
+        return pd.Series([r[1] for r in rows], index = index, name = 'amount_cents', dtype = 'int64') / 100
+
+    def by_month(self, year = None, category = None, start = None, end = None, rows = None):
+        # THE DATE RANGE IS APPLIED ROW BY ROW IN SQL, SO PARTIAL EDGE MONTHS NEED NO SPECIAL CASE
+        where, params = _where(start, end, category, year)
+        result = self.transactions._execute('SELECT transaction_year, transaction_month, SUM(amount_cents) FROM transactions{} '
+                                            'GROUP BY 1, 2 ORDER BY 1, 2'.format(where), params)
+        index = pd.MultiIndex.from_tuples([r[:2] for r in result], names = ['year', 'month'])
+        # Output -> Series of summed dollars indexed by (year, month), in calendar order
+        return pd.Series([r[2] for r in result], index = index, name = 'amount_cents', dtype = 'int64') / 100
+
+
+class SqliteStatementStore(StatementStore):
+    # StatementStore whose credit card transactions live in an SQLite file instead of memory. A card csv
+    # is only parsed when the database does not already hold its current contents (so a restart parses
+    # nothing), and is inserted file by file; bank statements stay in memory as before.
+    def __init__(self, directory, path, credit_loader, bank_loader, bank_summary, load = True, categorizer = None, detector = None):
+        self.path = path
+        # THE DETECTOR HAS SEEN EVERY ROW UP TO analysed_rowid; A FRESH PROCESS CATCHES UP ON ITS FIRST BUILD
+        self.anomalies = (detector or AnomalyDetector()).empty()
+        self.analysed_rowid = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+        conn = sqlite3.connect(path)
+        try:
+            # WAL LETS CALLBACKS KEEP READING THE LAST COMMITTED DATA WHILE A RELOAD WRITES
+            conn.execute('PRAGMA journal_mode = WAL')
+            identity = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'transactions_identity'").fetchone()
+            if identity is not None and 'account' not in identity[0]:
+                # AN IDENTITY WITHOUT THE ACCOUNT DROPPED MATCHING CHARGES FROM OTHER CARDS, SO EVERY FILE IS RELOADED
+                with conn:
+                    conn.execute('DROP INDEX transactions_identity')
+                    conn.execute('DELETE FROM transactions')
+                    conn.execute('DELETE FROM files')
+            conn.executescript(SCHEMA)
+            try:
+                conn.execute(SEARCH_SCHEMA)
+                self.fts = True
+            except sqlite3.OperationalError:
+                self.fts = False
+            with conn:
+                # DATABASES WRITTEN BEFORE SEARCH EXISTED GET THEIR DESCRIPTIONS INDEXED ONCE
+                if conn.execute('SELECT 1 FROM transactions LIMIT 1').fetchall() and not conn.execute('SELECT 1 FROM descriptions LIMIT 1').fetchall():
+                    self._index_descriptions(conn, [r[0] for r in conn.execute('SELECT DISTINCT description FROM transactions WHERE description IS NOT NULL')])
+        finally:
+            conn.close()
+        super().__init__(directory, credit_loader, bank_loader, bank_summary, load, categorizer, detector)
+
+    def _parse(self, path, kind):
+        if kind == 'credit':
+            return None
+        return super()._parse(path, kind)
+
+    def _index_descriptions(self, conn, descriptions):
+        for text in descriptions:
+            if conn.execute('INSERT OR IGNORE INTO descriptions VALUES (?)', (text,)).rowcount and self.fts:
+                conn.execute('INSERT INTO description_search (description) VALUES (?)', (text,))
+
+    def _insert(self, conn, df):
+        text = [df[c].astype(object).where(df[c].notna(), None) for c in ['account', 'description', 'category', 'type']]
+        rows = zip(text[0],
+                   df['transaction_date'].astype('int64').tolist(),
+                   df['transaction_year'].tolist(),
+                   df['transaction_month'].tolist(),
+                   *text[1:],
+                   df['amount_cents'].tolist(),
+                   df['occurrence'].tolist())
+        conn.executemany('INSERT OR IGNORE INTO transactions (account, transaction_date, transaction_year, transaction_month, '
+                         'description, category, type, amount_cents, occurrence) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        # ONLY DESCRIPTIONS NOT ALREADY IN THE SEARCH INDEX ARE ADDED TO IT
+        self._index_descriptions(conn, df['description'].dropna().unique().tolist())
+
+    def _analyse(self, conn, anomalies, after):
+        # ROWIDS ONLY GROW BETWEEN FULL RELOADS, SO THE ROWS PAST after ARE EXACTLY THOSE NOT YET ANALYSED
+        # Output -> (detector, last analysed rowid)
+        earliest = conn.execute('SELECT MIN(transaction_year * 12 + transaction_month - 1) FROM transactions WHERE rowid > ?', (after,)).fetchone()[0]
+        if earliest is None:
+            return anomalies, after
+        if anomalies.month is not None and earliest < anomalies.month:
+            # NEW ROWS FROM BEFORE THE LATEST MONTH ALREADY SCORED: THE WHOLE TABLE IS RE-SCORED IN DATE ORDER
+            anomalies, after = anomalies.empty(), 0
+        # IN DATE ORDER, SO EACH CHUNK STARTS NO EARLIER THAN THE MONTH THE PREVIOUS ONE ENDED IN
+        cursor = conn.execute('SELECT rowid, transaction_date, description, category, amount_cents, transaction_year, transaction_month '
+                              'FROM transactions WHERE rowid > ? ORDER BY transaction_date, rowid', (after,))
+        while True:
+            rows = cursor.fetchmany(CHUNK_ROWS)
+            if not rows:
+                return anomalies, after
+            df = pd.DataFrame.from_records(rows, columns = ['rowid'] + COLUMNS[:2] + ['category', 'amount_cents', 'transaction_year', 'transaction_month'])
+            df['transaction_date'] = pd.to_datetime(df['transaction_date'].astype('int64'))
+            anomalies.add(df)
+            after = max(after, int(df['rowid'].max()))
+
+    def _build(self, files, appended):
+        credit = sorted(p for p, f in files.items() if f['kind'] == 'credit')
+        bank = [f['frame'] for p, f in sorted(files.items()) if f['kind'] == 'bank']
+        if not credit or not bank:
+            raise ValueError('{} needs at least one credit card and one bank statement csv'.format(self.directory))
+        version = self._version(files)
+
+        current = {os.path.abspath(p) : files[p]['fingerprint']['sha1'] for p in credit}
+        anomalies, analysed = self.anomalies.copy(), self.analysed_rowid
+        conn = sqlite3.connect(self.path)
+        try:
+            with conn:
+                stored = dict(conn.execute('SELECT path, sha1 FROM files').fetchall())
+                if any(current.get(p) != sha1 for p, sha1 in stored.items()):
+                    # AN EDITED OR REMOVED EXPORT MAY HAVE BEEN THE ONLY SOURCE OF SOME ROWS, SO ALL ARE RELOADED
+                    conn.execute('DELETE FROM transactions')
+                    conn.execute('DELETE FROM files')
+                    conn.execute('DELETE FROM descriptions')
+                    if self.fts:
+                        conn.execute('DELETE FROM description_search')
+                    stored = {}
+                    anomalies, analysed = self.detector.empty(), 0
+                for path in credit:
+                    if os.path.abspath(path) in stored:
+                        continue
+                    try:
+                        df = self._parse_credit(path)
+                    except (OSError, KeyError, ValueError):
+                        # A HALF-WRITTEN OR MALFORMED EXPORT IS SKIPPED AND RETRIED ONCE ITS MTIME CHANGES AGAIN
+                        continue
+                    self._insert(conn, df)
+                    conn.execute('INSERT INTO files VALUES (?, ?)', (os.path.abspath(path), current[os.path.abspath(path)]))
+            anomalies, analysed = self._analyse(conn, anomalies, analysed)
+        finally:
+            conn.close()
+        self.anomalies, self.analysed_rowid = anomalies, analysed
+
+        ledger = merge_statements(bank, BANK_KEYS, 'Posting Date')
+        balance, income = self.bank_summary(ledger, 'month')
+        transactions = SqliteTransactions(self.path)
+        return Dataset(None, ledger, balance, income, version, SqliteSpending(transactions), transactions, anomalies)